@@ -1,122 +1,33 @@
 import streamlit as st
-import openai
-import google.generativeai as genai
-import json
-import os
-import pandas as pd
 from datetime import datetime
-import time
-
-SETTINGS_FILE = "settings.json"
-
-# Initialize session state for history
-if 'script_history' not in st.session_state:
-    st.session_state.script_history = []
-
-# --- Settings Functions ---
-def load_settings():
-    """Loads settings from a JSON file."""
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, 'r') as f:
-            return json.load(f)
-    return {
-        "api_provider": "OpenAI",
-        "api_key": "",
-        "model": "gpt-4"
-    }
-
-def save_settings(settings):
-    """Saves settings to a JSON file."""
-    with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f, indent=4)
-
-def add_to_history(topic, video_length, script, avatar=None, timestamp=None):
-    """Adds a generated script to history."""
-    if timestamp is None:
-        timestamp = datetime.now()
-    
-    history_item = {
-        'timestamp': timestamp,
-        'topic': topic,
-        'video_length': video_length,
-        'avatar': avatar,  # Store avatar/persona
-        'script': script
-    }
-    st.session_state.script_history.append(history_item)
-
-def create_excel_file(script, topic, video_length):
-    """Creates Excel file content from script."""
-    try:
-        # Parse the markdown table to extract data
-        lines = script.strip().split('\n')
-        table_data = []
-        headers = []
-        
-        for line in lines:
-            if line.startswith('|') and line.endswith('|'):
-                # Remove leading/trailing | and split
-                cells = [cell.strip() for cell in line[1:-1].split('|')]
-                if '---' not in line:  # Skip separator lines
-                    if not headers:
-                        headers = cells
-                    else:
-                        table_data.append(cells)
-        
-        # Create DataFrame
-        df = pd.DataFrame(table_data, columns=headers)
-        
-        # Create Excel file in memory
-        output = pd.ExcelWriter('temp.xlsx', engine='openpyxl')
-        df.to_excel(output, sheet_name='Script', index=False)
-        
-        # Auto-adjust column widths
-        worksheet = output.sheets['Script']
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-        
-        output.close()
-        
-        # Read the file and return its content
-        with open('temp.xlsx', 'rb') as f:
-            file_content = f.read()
-        
-        # Clean up temp file
-        os.remove('temp.xlsx')
-        
-        return file_content
-    except Exception as e:
-        st.error(f"Error creating Excel file: {e}")
-        return None
-
-def extract_voiceover_txt(script):
-    """Extracts the Voiceover column from the markdown table in the script and returns it as plain text."""
-    lines = script.strip().split('\n')
-    table_data = []
-    headers = []
-    for line in lines:
-        if line.startswith('|') and line.endswith('|'):
-            cells = [cell.strip() for cell in line[1:-1].split('|')]
-            if '---' not in line:
-                if not headers:
-                    headers = cells
-                else:
-                    table_data.append(cells)
-    if not headers or 'Voiceover' not in headers:
-        return None
-    voiceover_idx = headers.index('Voiceover')
-    voiceover_lines = [row[voiceover_idx] for row in table_data if len(row) > voiceover_idx]
-    # Remove surrounding quotes if present
-    voiceover_lines = [v.strip('"') for v in voiceover_lines]
-    return '\n'.join(voiceover_lines)
+from functools import partial
+from exports import XLSX_MIME, extract_voiceover_txt, items_to_voiceover_zip, items_to_xlsx, script_to_xlsx
+from generation import BATCH_MODES, CANCELLED_ERROR, clear_clients
+from history_store import HistoryStore
+from jobs import DONE, FAILED, QUEUED, RUNNING, VARIATION_DONE, JobManager
+from metrics import get_metrics
+from script_table import DEFAULT_MAX_WORDS_PER_SECOND, validate_script_timing
+from similarity import DUPLICATE_SIMILARITY
+from settings import (
+    DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_TTL_HOURS, DEFAULT_HEDGE_DELAY_SECONDS, DEFAULT_HEDGE_MIN_SAMPLES,
+    DEFAULT_HEDGE_QUANTILE, DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RETRIES, DEFAULT_MODEL_PRICES, DEFAULT_RATE_LIMITS,
+    HISTORY_DB_FILE, load_settings, open_response_cache, provider_config, provider_rate_limits, save_settings
+)
+
+HISTORY_PAGE_SIZES = [10, 25, 50]
+API_PROVIDERS = ["OpenAI", "Gemini", "OpenRouter"]
+MAX_FALLBACK_PROVIDERS = 3
+METRICS_TIMINGS = [("latency", "Latency"), ("ttft", "TTFT"), ("queue_wait", "Queue wait")]
+MAX_ACTIVE_JOBS_PER_SESSION = 5
+JOB_POLL_SECONDS = 1
+JOB_STATUS_LABELS = {
+    "queued": "Queued", "running": "Generating...", "done": "Done", "cancelled": "Cancelled", "failed": "Failed"
+}
+
+@st.cache_resource(show_spinner=False)
+def get_history_store():
+    """Returns the persistent history store, shared across reruns and sessions."""
+    return HistoryStore(HISTORY_DB_FILE)
 
 # Load existing settings and store them in session state
 if 'settings_loaded' not in st.session_state:
@@ -124,286 +35,350 @@ if 'settings_loaded' not in st.session_state:
     st.session_state.api_provider = settings.get("api_provider", "OpenAI")
     st.session_state.api_key = settings.get("api_key", "")
     st.session_state.model = settings.get("model", "gpt-4")
+    st.session_state.max_concurrency = settings.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+    st.session_state.stream_output = settings.get("stream_output", True)
+    st.session_state.batch_mode = settings.get("batch_mode", "Per variation")
+    st.session_state.cache_enabled = settings.get("cache_enabled", True)
+    st.session_state.cache_ttl_hours = settings.get("cache_ttl_hours", DEFAULT_CACHE_TTL_HOURS)
+    st.session_state.cache_max_entries = settings.get("cache_max_entries", DEFAULT_CACHE_MAX_ENTRIES)
+    st.session_state.max_retries = settings.get("max_retries", DEFAULT_MAX_RETRIES)
+    st.session_state.rate_limits = settings.get("rate_limits", DEFAULT_RATE_LIMITS)
+    st.session_state.model_prices = settings.get("model_prices", DEFAULT_MODEL_PRICES)
+    st.session_state.fallback_providers = settings.get("fallback_providers", [])
+    st.session_state.hedging_enabled = settings.get("hedging_enabled", False)
+    st.session_state.hedge_quantile = settings.get("hedge_quantile", DEFAULT_HEDGE_QUANTILE)
+    st.session_state.hedge_min_samples = settings.get("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES)
+    st.session_state.hedge_delay_seconds = settings.get("hedge_delay_seconds", DEFAULT_HEDGE_DELAY_SECONDS)
+    st.session_state.repair_segments = settings.get("repair_segments", True)
+    st.session_state.max_words_per_second = settings.get("max_words_per_second", DEFAULT_MAX_WORDS_PER_SECOND)
+    st.session_state.dedupe_variations = settings.get("dedupe_variations", True)
+    st.session_state.duplicate_similarity = settings.get("duplicate_similarity", DUPLICATE_SIMILARITY)
     st.session_state.settings_loaded = True
 
-# System prompt from user instructions
-SYSTEM_PROMPT = """Create a TikTok video script for a specified topic, in colloquial Bahasa Malaysia (bahasa pasar/Manglish). Your audience consists of young, inquisitive users eager to learn. Write the script to explain the topic concisely yet comprehensively, capturing attention initially, maintaining interest, and concluding with a call to action.
-
-- **Tone & Style**: Use a casual, conversational tone in colloquial Bahasa Malaysia (bahasa pasar/Manglish). This includes using "kau" or "korang" instead of formal "anda", "tak" instead of "tidak", "je" instead of "saja", "nak" instead of "hendak", "dah" instead of "sudah", and other colloquial features. Incorporate TikTok trends if relevant. Target three potential video lengths: 15 seconds, 30 seconds, or 60 seconds.
-- **Visual Elements**: Include visual cues and overlays to highlight key points. Assume a mix of direct-to-camera and visual overlay parts.
-
-# Steps
-
-1. **Opening**: 
-    - Ensure the first few seconds are engaging.
-    - Provide a hook to grab attention.
-2. **Content**:
-    - Maintain a clear, concise explanation of the topic.
-    - Keep the content engaging and relevant.
-3. **Closing**:
-    - Include a call to action, encouraging further engagement.
-
-# Output Format
-
-- **Table Format**: Present the script in a markdown table with four columns: `Timestamp`, `Visual`, `Text Overlay`, and `Voiceover`.
-- **Language**: The `Text Overlay` and `Voiceover` columns must be in colloquial Bahasa Malaysia (bahasa pasar/Manglish).
-- **Timestamp**: Indicate the start and end time for each segment (e.g., 0:00-0:03).
-- **Visual**: Describe the visual elements of the scene.
-- **Text Overlay**: Write any text that should appear on the screen (in colloquial Bahasa Malaysia).
-- **Voiceover**: Write the spoken words for the script (in colloquial Bahasa Malaysia).
-
-# Colloquial Bahasa Malaysia Features
-Use these colloquial features in your script:
-- "kau" or "korang" instead of "anda" (you)
-- "tak" instead of "tidak" (not)
-- "je" instead of "saja" (only/just)
-- "nak" instead of "hendak" (want)
-- "dah" instead of "sudah" (already)
-- "sangat" or "gila" instead of "amat" (very)
-- "faham" or "paham" (understand)
-- "boleh" or "leh" (can)
-- "kat" instead of "di" (at/in)
-- "dengan" (with)
-- "ni" instead of "ini" (this)
-- "tu" instead of "itu" (that)
-- "ke" (to)
-- "pada" (at/to)
-- "macam" instead of "seperti" (like)
-- "gila" instead of "sangat" (very/extremely)
-- "wey" or "weh" as interjections
-- "la" or "lah" as sentence endings
-
-# Example
-
-| Timestamp | Visual | Text Overlay | Voiceover |
-| --- | --- | --- | --- |
-| 0:00-0:03 | [Muka speaker nampak teruja] | Korang tahu tak? | "Eh korang, korang tahu tak perang paling sekejap dalam sejarah dunia cuma 38 minit je?" |
-| 0:04-0:08 | [Gambar-gambar lama Perang Inggeris-Zanzibar] | 27 Ogos 1896 | "Betul wey! Perang Inggeris-Zanzibar tahun 1896. Zanzibar surrender lepas kena bedil dengan kapal British 38 minit je." |
-| 0:09-0:15 | [Speaker kembali senyum kat skrin] | #sejarah #faktamenarik | "Nak tahu lagi fakta sejarah gila-gila macam ni? Follow aku!" |
-
-# Notes
-- Ensure the script suits a maximum of 60 seconds in length.
-- Be mindful of creating an engaging narrative flow.
-- Consider using trendy TikTok sound effects or edits where appropriate.
-- Always use colloquial Bahasa Malaysia features consistently throughout the script.
-- Make sure the language sounds natural and conversational, like how young Malaysians actually speak.
-"""
-
-def generate_script(topic, video_length, avatar=None):
-    """Generates the TikTok script using the configured AI provider."""
+def get_provider_config():
+    """Snapshots the provider settings from session state so they can be used outside the script thread."""
+    return provider_config({
+        "api_provider": st.session_state.api_provider,
+        "api_key": st.session_state.api_key,
+        "model": st.session_state.model,
+        "max_concurrency": st.session_state.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+        "max_retries": st.session_state.get("max_retries", DEFAULT_MAX_RETRIES),
+        "rate_limits": st.session_state.get("rate_limits", DEFAULT_RATE_LIMITS),
+        "fallback_providers": st.session_state.get("fallback_providers", []),
+        "hedging_enabled": st.session_state.get("hedging_enabled", False),
+        "hedge_quantile": st.session_state.get("hedge_quantile", DEFAULT_HEDGE_QUANTILE),
+        "hedge_min_samples": st.session_state.get("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES),
+        "hedge_delay_seconds": st.session_state.get("hedge_delay_seconds", DEFAULT_HEDGE_DELAY_SECONDS),
+        "repair_segments": st.session_state.get("repair_segments", True),
+        "max_words_per_second": st.session_state.get("max_words_per_second", DEFAULT_MAX_WORDS_PER_SECOND),
+        "dedupe_variations": st.session_state.get("dedupe_variations", True),
+        "duplicate_similarity": st.session_state.get("duplicate_similarity", DUPLICATE_SIMILARITY)
+    })
+
+@st.cache_resource(show_spinner=False)
+def get_job_manager():
+    """Returns the background job manager, shared across reruns and sessions."""
+    return JobManager()
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache(ttl_hours=DEFAULT_CACHE_TTL_HOURS, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+    """Returns the on-disk response cache, shared across reruns and sessions."""
+    return open_response_cache(ttl_hours, max_entries)
+
+def get_session_response_cache():
+    """Returns the response cache configured in Settings."""
+    return get_response_cache(
+        st.session_state.get("cache_ttl_hours", DEFAULT_CACHE_TTL_HOURS),
+        st.session_state.get("cache_max_entries", DEFAULT_CACHE_MAX_ENTRIES)
+    )
+
+def check_provider_config():
+    """Shows an error and returns False if the API key or model is missing."""
     if not st.session_state.get("api_key"):
         st.error("Please enter your API key in the Settings tab.")
-        return None, False
+        return False
     if not st.session_state.get("model"):
         st.error("Please configure the model in the Settings tab.")
-        return None, False
+        return False
+    return True
 
-    try:
-        provider = st.session_state.api_provider
-        api_key = st.session_state.api_key
-        model_name = st.session_state.model
-        
-        user_prompt = f"Create a {video_length}-second TikTok script about {topic}."
-        if avatar:
-            user_prompt += f"\n\nThe script should be tailored for this product/service avatar/persona: {avatar}"
-
-        if provider == "OpenAI":
-            client = openai.OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-            )
-            script = response.choices[0].message.content
-            add_to_history(topic, video_length, script, avatar)
-            return script, True
-        
-        elif provider == "OpenRouter":
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url="https://openrouter.ai/api/v1"
-            )
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                extra_headers={
-                    "HTTP-Referer": "http://localhost:8501", 
-                    "X-Title": "TikTok Script Generator" 
-                }
-            )
-            script = response.choices[0].message.content
-            add_to_history(topic, video_length, script, avatar)
-            return script, True
-
-        elif provider == "Gemini":
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name)
-            full_prompt = f"{SYSTEM_PROMPT}\n\n---\n\n{user_prompt}"
-            response = model.generate_content(full_prompt)
-            script = response.text
-            add_to_history(topic, video_length, script, avatar)
-            return script, True
-
-    except Exception as e:
-        st.error(f"An error occurred: {e}")
-        return None, False
-
-def generate_description_and_hashtags(script, topic):
-    """Uses the AI provider to generate a short description and relevant hashtags for the script."""
-    provider = st.session_state.api_provider
-    api_key = st.session_state.api_key
-    model_name = st.session_state.model
-    prompt = (
-        f"Given the following TikTok script about '{topic}', "
-        "write a short, catchy description (1-2 sentences, in colloquial Bahasa Malaysia) "
-        "and suggest 3-6 relevant TikTok hashtags (in Bahasa Malaysia and/or English, separated by spaces, no # in description, only in hashtags). "
-        "Format:\nDescription: ...\nHashtags: #tag1 #tag2 #tag3 ...\n\nScript:\n{script}"
+def submit_batch_job(topic, video_length, avatar=None, n_variations=7, use_cache=None, batch_mode=None):
+    """Queues a batch of TikTok scripts (7 variations), with descriptions and hashtags, as a background job.
+
+    Responses come from the response cache unless use_cache is False (defaults to the Settings value).
+    batch_mode "Single request" asks for all variations (and their descriptions) as structured JSON in
+    as few requests as the output token budget allows; defaults to the Settings value.
+
+    The job keeps running across reruns; it is added to this session's job list, and its scripts are
+    added to history when it finishes. Returns the BatchJob, or None if it could not be queued.
+    """
+    if not check_provider_config():
+        return None
+    jobs = st.session_state.setdefault("batch_jobs", [])
+    if sum(job.active for job in jobs) >= MAX_ACTIVE_JOBS_PER_SESSION:
+        st.warning(f"You already have {MAX_ACTIVE_JOBS_PER_SESSION} batches queued or running. Wait for one to finish or cancel one.")
+        return None
+    if use_cache is None:
+        use_cache = st.session_state.get("cache_enabled", True)
+    cache = get_session_response_cache() if use_cache else None
+    if batch_mode is None:
+        batch_mode = st.session_state.get("batch_mode", "Per variation")
+    job = get_job_manager().submit(
+        get_provider_config(), topic, video_length, avatar, n_variations, cache, batch_mode,
+        stream=st.session_state.get("stream_output", True), history=get_history_store()
     )
-    try:
-        if provider == "OpenAI":
-            client = openai.OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant for social media content."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=200
-            )
-            return response.choices[0].message.content.strip()
-        elif provider == "OpenRouter":
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url="https://openrouter.ai/api/v1"
-            )
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant for social media content."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=200,
-                extra_headers={
-                    "HTTP-Referer": "http://localhost:8501",
-                    "X-Title": "TikTok Script Generator"
-                }
-            )
-            return response.choices[0].message.content.strip()
-        elif provider == "Gemini":
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt)
-            return response.text.strip()
-    except Exception as e:
-        st.error(f"Error generating description/hashtags: {e}")
-        return ""
-
-def generate_script_batch(topic, video_length, avatar=None, n_variations=7):
-    """Generates a batch of TikTok scripts (7 variations) using chunking to avoid token/response length issues. Also generates description and hashtags for each."""
+    jobs.insert(0, job)
+    return job
+
+def dismiss_batch_job(job):
+    st.session_state.batch_jobs = [other for other in st.session_state.get("batch_jobs", []) if other is not job]
+
+def render_batch_results(job):
+    """Shows a finished job's scripts with their exports."""
     scripts = []
     desc_tags = []
-    for i in range(n_variations):
-        # Add a variation hint to the prompt for more diversity
-        variation_avatar = avatar
-        if avatar:
-            variation_avatar = f"{avatar} (Variation {i+1})"
-        script, success = generate_script(topic, video_length, variation_avatar)
+    for i, (script, desc_tag, error) in enumerate(job.results or []):
+        if error and error != CANCELLED_ERROR:
+            st.error(f"Variation {i+1}: {error}")
         if script:
             scripts.append(script)
-            desc_tag = generate_description_and_hashtags(script, topic)
             desc_tags.append(desc_tag)
+    if not scripts:
+        return
+    topic = job.topic
+    video_length = job.video_length
+    st.subheader(f"Your {len(scripts)} TikTok Script Variations:")
+    # Bulk export of the whole batch, built only when clicked
+    batch_items = [
+        {
+            'timestamp': job.created_at,
+            'topic': topic,
+            'video_length': video_length,
+            'avatar': job.avatar,
+            'script': script,
+            'description': desc_tags[idx]
+        }
+        for idx, script in enumerate(scripts)
+    ]
+    batch_stamp = job.created_at.strftime('%Y%m%d_%H%M%S')
+    col_xlsx, col_zip = st.columns(2)
+    with col_xlsx:
+        st.download_button(
+            label="\U0001F4E5 Download All Variations (.xlsx)",
+            data=partial(items_to_xlsx, batch_items),
+            file_name=f"tiktok_scripts_{topic.replace(' ', '_')}_{video_length}s_{batch_stamp}.xlsx",
+            mime=XLSX_MIME,
+            key=f"download_batch_xlsx_{job.id}",
+            on_click="ignore"
+        )
+    with col_zip:
+        st.download_button(
+            label="\U0001F4DD Download All Voiceovers (.zip)",
+            data=partial(items_to_voiceover_zip, batch_items),
+            file_name=f"tiktok_voiceovers_{topic.replace(' ', '_')}_{video_length}s_{batch_stamp}.zip",
+            mime="application/zip",
+            key=f"download_batch_zip_{job.id}",
+            on_click="ignore"
+        )
+    max_words_per_second = job.config.get("max_words_per_second", DEFAULT_MAX_WORDS_PER_SECOND)
+    for idx, script in enumerate(scripts):
+        st.markdown(f"### Variation {idx+1}")
+        st.markdown(script)
+        # Timing problems that segment repair could not fix (or that were not repaired)
+        timing_issues = validate_script_timing(script, video_length, max_words_per_second)
+        if timing_issues:
+            st.warning("Timing check: " + " ".join(
+                problem if row is None else f"Row {row+1}: {problem}" for row, problem in timing_issues
+            ))
+        # Show description and hashtags after the table
+        if desc_tags[idx]:
+            st.markdown(f"**Suggested Description & Hashtags:**\n\n{desc_tags[idx]}")
+        # Export functionality
+        st.subheader("Export to Excel:")
+        # Workbooks are built only when a download is clicked
+        filename = f"tiktok_script_{topic.replace(' ', '_')}_{video_length}s_var{idx+1}_{batch_stamp}.xlsx"
+        st.download_button(
+            label="\U0001F4E5 Download Excel File",
+            data=partial(script_to_xlsx, script),
+            file_name=filename,
+            mime=XLSX_MIME,
+            key=f"download_excel_{job.id}_var_{idx}",
+            on_click="ignore"
+        )
+        # Export Voiceover to TXT
+        voiceover_txt = extract_voiceover_txt(script)
+        if voiceover_txt:
+            txt_filename = f"tiktok_voiceover_{topic.replace(' ', '_')}_{video_length}s_var{idx+1}_{batch_stamp}.txt"
+            st.download_button(
+                label="\U0001F4DD Download Voiceover (.txt)",
+                data=voiceover_txt,
+                file_name=txt_filename,
+                mime="text/plain",
+                key=f"download_txt_{job.id}_var_{idx}",
+                on_click="ignore"
+            )
+
+def render_batch_job(job):
+    """Shows one job: progress and partial scripts while it runs, the results once it is done."""
+    title = f"{job.topic} ({job.video_length}s) - {job.created_at.strftime('%H:%M:%S')}"
+    with st.container(border=True):
+        col_title, col_action = st.columns([4, 1])
+        with col_title:
+            st.markdown(f"**{title}** - {JOB_STATUS_LABELS[job.status]}")
+        with col_action:
+            if job.active:
+                st.button("Cancel", key=f"cancel_job_{job.id}", on_click=JobManager.cancel, args=(job,))
+            else:
+                st.button("Dismiss", key=f"dismiss_job_{job.id}", on_click=dismiss_batch_job, args=(job,))
+        if job.status == QUEUED:
+            st.caption("Waiting for another batch to finish...")
+        elif job.status == RUNNING:
+            st.progress(
+                job.finished_variations / job.n_variations,
+                text=f"{job.finished_variations} of {job.n_variations} variations done ({job.elapsed:.0f}s)"
+            )
+            # Draw each variation's table row by row while the batch is running
+            for idx, partial_script in enumerate(job.partial_scripts):
+                if partial_script:
+                    status = "done" if job.variation_status[idx] == VARIATION_DONE else "generating..."
+                    st.markdown(f"### Variation {idx+1} ({status})")
+                    st.markdown(partial_script)
+        elif job.status == FAILED:
+            st.error(f"An error occurred: {job.error}")
         else:
-            desc_tags.append("")
-    return scripts, desc_tags
+            if job.status == DONE:
+                st.success(f"Scripts generated in {job.elapsed:.2f} seconds.")
+            render_batch_results(job)
+
+def render_batch_jobs(polling):
+    """Shows this session's batch jobs, newest first. While polling, the fragment reruns every second;
+    once no job is active any more the whole app reruns so polling stops."""
+    jobs = st.session_state.get("batch_jobs", [])
+    if polling and not any(job.active for job in jobs):
+        st.rerun()
+    for job in jobs:
+        render_batch_job(job)
 
 # --- UI Setup ---
-tab_generator, tab_history, tab_settings = st.tabs(["Script Generator", "History", "Settings"])
+tab_generator, tab_history, tab_metrics, tab_settings = st.tabs(["Script Generator", "History", "Metrics", "Settings"])
 
 with tab_generator:
     st.title("TikTok Script Generator")
     topic = st.text_input("Enter the topic for your TikTok video:")
     video_length = st.selectbox("Select video length (in seconds):", [15, 30, 60])
     avatar = st.text_input("Describe your product/service avatar or persona (optional):")  # New input
+    bypass_cache = st.checkbox("Bypass cache (always generate fresh scripts)", key="bypass_cache")
+
+    # Close matches already in history, so existing scripts can be reused instead of regenerated
+    similar_topics = get_history_store().similar_topics(topic) if topic else []
+    if similar_topics:
+        with st.expander(f"\U0001F50D {len(similar_topics)} similar topic(s) already in history"):
+            for match in similar_topics:
+                item = match['item']
+                st.markdown(
+                    f"**{item['topic']}** ({item['video_length']}s) · {match['similarity']:.0%} match · "
+                    f"{match['count']} script(s), latest {item['timestamp'].strftime('%Y-%m-%d %H:%M')}"
+                )
+                if st.checkbox("Show latest script", key=f"show_similar_topic_{item['id']}"):
+                    st.markdown(item['script'])
+            st.caption("Search the History tab for these topics to reuse or export their scripts.")
 
     if st.button("Generate Script"):
         if not topic:
             st.warning("Please enter a topic.")
         else:
-            with st.spinner("Generating 7 script variations in batch..."):
-                start_time = time.time()
-                scripts, desc_tags = generate_script_batch(topic, video_length, avatar, n_variations=7)
-                elapsed = time.time() - start_time
-                if scripts:
-                    st.success(f"Scripts generated in {elapsed:.2f} seconds.")
-                    st.subheader("Your 7 TikTok Script Variations:")
-                    for idx, script in enumerate(scripts):
-                        st.markdown(f"### Variation {idx+1}")
-                        st.markdown(script)
-                        # Show description and hashtags after the table
-                        if desc_tags[idx]:
-                            st.markdown(f"**Suggested Description & Hashtags:**\n\n{desc_tags[idx]}")
-                        # Export functionality
-                        st.subheader("Export to Excel:")
-                        excel_content = create_excel_file(script, topic, video_length)
-                        if excel_content:
-                            filename = f"tiktok_script_{topic.replace(' ', '_')}_{video_length}s_var{idx+1}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                            st.download_button(
-                                label="\U0001F4E5 Download Excel File",
-                                data=excel_content,
-                                file_name=filename,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key=f"download_excel_var_{idx}"
-                            )
-                        # Export Voiceover to TXT
-                        voiceover_txt = extract_voiceover_txt(script)
-                        if voiceover_txt:
-                            txt_filename = f"tiktok_voiceover_{topic.replace(' ', '_')}_{video_length}s_var{idx+1}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                            st.download_button(
-                                label="\U0001F4DD Download Voiceover (.txt)",
-                                data=voiceover_txt,
-                                file_name=txt_filename,
-                                mime="text/plain",
-                                key=f"download_txt_var_{idx}"
-                            )
+            submit_batch_job(topic, video_length, avatar, n_variations=7, use_cache=False if bypass_cache else None)
+
+    # Batches run in the background, so the page stays usable while they generate
+    polling = any(job.active for job in st.session_state.get("batch_jobs", []))
+    st.fragment(render_batch_jobs, run_every=JOB_POLL_SECONDS if polling else None)(polling)
 
 with tab_history:
     st.title("Generated Scripts History")
+    history_store = get_history_store()
     
-    if not st.session_state.script_history:
+    if not history_store.count():
         st.info("No scripts generated yet. Generate your first script in the Script Generator tab!")
     else:
+        # Search and filters, applied to both the list and bulk export
+        col_topic, col_length, col_model = st.columns(3)
+        with col_topic:
+            search_topic = st.text_input("Search topic:", key="history_search_topic")
+        with col_length:
+            filter_lengths = st.multiselect("Video lengths:", [15, 30, 60], default=[15, 30, 60], key="history_filter_lengths")
+        with col_model:
+            provider_models = history_store.provider_models()
+            model_labels = ["All"] + [f"{provider} / {model}" for provider, model in provider_models]
+            model_choice = st.selectbox("Provider / model:", model_labels, key="history_filter_model")
+        history_filters = {'topic': search_topic, 'video_lengths': filter_lengths}
+        if model_choice != "All":
+            history_filters['provider'], history_filters['model'] = provider_models[model_labels.index(model_choice) - 1]
+        total_items = history_store.count(**history_filters)
+
+        # Bulk export of the filtered history
+        with st.expander("\U0001F4E6 Bulk Export"):
+            st.caption(f"{total_items} script(s) selected.")
+            if total_items:
+                export_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                col_xlsx, col_zip = st.columns(2)
+                with col_xlsx:
+                    st.download_button(
+                        label="\U0001F4E5 Download Selected (.xlsx)",
+                        data=lambda filters=dict(history_filters): items_to_xlsx(history_store.iter_items(**filters)),
+                        file_name=f"tiktok_scripts_history_{export_stamp}.xlsx",
+                        mime=XLSX_MIME,
+                        key="download_history_bulk_xlsx",
+                        on_click="ignore"
+                    )
+                with col_zip:
+                    st.download_button(
+                        label="\U0001F4DD Download Selected Voiceovers (.zip)",
+                        data=lambda filters=dict(history_filters): items_to_voiceover_zip(history_store.iter_items(**filters)),
+                        file_name=f"tiktok_voiceovers_history_{export_stamp}.zip",
+                        mime="application/zip",
+                        key="download_history_bulk_zip",
+                        on_click="ignore"
+                    )
+
+        # Only the current page is rendered
+        col_size, col_page = st.columns(2)
+        with col_size:
+            page_size = st.selectbox("Scripts per page:", HISTORY_PAGE_SIZES, key="history_page_size")
+        page_count = max(1, -(-total_items // page_size))
+        if st.session_state.get("history_page", 1) > page_count:
+            # Filters or deletions shrank the result set
+            st.session_state.history_page = page_count
+        with col_page:
+            page = st.number_input(f"Page (of {page_count}):", min_value=1, max_value=page_count, step=1, key="history_page")
+        if not total_items:
+            st.info("No scripts match these filters.")
+
         # Show history in reverse chronological order
-        for i, item in enumerate(reversed(st.session_state.script_history)):
+        for item in history_store.query(limit=page_size, offset=(page - 1) * page_size, **history_filters):
             with st.expander(f"\U0001F4DD {item['topic']} ({item['video_length']}s) - {item['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}"):
                 st.markdown(f"**Topic:** {item['topic']}")
                 st.markdown(f"**Length:** {item['video_length']} seconds")
                 st.markdown(f"**Generated:** {item['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
                 if item.get('avatar'):
                     st.markdown(f"**Avatar/Persona:** {item['avatar']}")  # Show avatar if present
+                if item.get('model'):
+                    st.markdown(f"**Model:** {item['provider']} / {item['model']}")
                 st.markdown("---")
                 st.markdown(item['script'])
+                if item.get('description'):
+                    st.markdown(f"**Suggested Description & Hashtags:**\n\n{item['description']}")
                 
                 # Export functionality
                 st.subheader("Export to Excel:")
-                excel_content = create_excel_file(item['script'], item['topic'], item['video_length'])
-                if excel_content:
-                    filename = f"tiktok_script_{item['topic'].replace(' ', '_')}_{item['video_length']}s_{item['timestamp'].strftime('%Y%m%d_%H%M%S')}.xlsx"
-                    st.download_button(
-                        label="\U0001F4E5 Download Excel File",
-                        data=excel_content,
-                        file_name=filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        key=f"download_history_{i}"
-                    )
+                filename = f"tiktok_script_{item['topic'].replace(' ', '_')}_{item['video_length']}s_{item['timestamp'].strftime('%Y%m%d_%H%M%S')}.xlsx"
+                st.download_button(
+                    label="\U0001F4E5 Download Excel File",
+                    data=partial(script_to_xlsx, item['script']),
+                    file_name=filename,
+                    mime=XLSX_MIME,
+                    key=f"download_history_{item['id']}",
+                    on_click="ignore"
+                )
                 # Export Voiceover to TXT
                 voiceover_txt = extract_voiceover_txt(item['script'])
                 if voiceover_txt:
@@ -413,30 +388,106 @@ with tab_history:
                         data=voiceover_txt,
                         file_name=txt_filename,
                         mime="text/plain",
-                        key=f"download_txt_history_{i}"
+                        key=f"download_txt_history_{item['id']}",
+                        on_click="ignore"
                     )
                 
+                # Near-duplicates of this script elsewhere in history
+                if st.checkbox("Show similar scripts", key=f"similar_history_{item['id']}"):
+                    similar_scripts = history_store.similar_scripts(item['script'], exclude_id=item['id'])
+                    for similarity, other in similar_scripts:
+                        st.markdown(
+                            f"- {similarity:.0%} similar: **{other['topic']}** ({other['video_length']}s) - "
+                            f"{other['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}"
+                        )
+                    if not similar_scripts:
+                        st.caption("No near-duplicates in history.")
+
                 # Delete functionality
-                if st.button(f"🗑️ Delete Script", key=f"delete_history_{i}"):
-                    # Remove from history (accounting for reversed order)
-                    actual_index = len(st.session_state.script_history) - 1 - i
-                    st.session_state.script_history.pop(actual_index)
+                if st.button(f"🗑️ Delete Script", key=f"delete_history_{item['id']}"):
+                    history_store.delete(item['id'])
                     st.rerun()
         
         # Clear all history button
         if st.button("🗑️ Clear All History"):
-            st.session_state.script_history = []
+            history_store.clear()
             st.rerun()
 
+with tab_metrics:
+    st.title("Provider Metrics")
+    metrics = get_metrics()
+    model_prices = st.session_state.get("model_prices", DEFAULT_MODEL_PRICES)
+    metrics_rows = metrics.summary(model_prices)
+    st.caption(
+        f"Every provider call since {datetime.fromtimestamp(metrics.started_at).strftime('%Y-%m-%d %H:%M:%S')}, "
+        "across all sessions. Timings are in seconds; percentiles cover the most recent calls."
+    )
+    if not metrics_rows:
+        st.info("No provider calls yet. Generate some scripts to see latency, token and cache metrics here.")
+    else:
+        def format_seconds(value):
+            return "" if value is None else f"{value:.2f}"
+
+        table = []
+        for row in metrics_rows:
+            display_row = {
+                "Provider": row["provider"],
+                "Model": row["model"],
+                "Request": row["kind"],
+                "Calls": row["calls"],
+                "Errors": row["errors"],
+                "Retries": row["retries"],
+                "Cache hit rate": "" if row["cache_hit_rate"] is None else f"{row['cache_hit_rate']:.0%}"
+            }
+            for name, label in METRICS_TIMINGS:
+                for quantile in ("p50", "p95", "p99"):
+                    display_row[f"{label} {quantile}"] = format_seconds(row[f"{name}_{quantile}"])
+            display_row["Prompt tokens"] = row["prompt_tokens"]
+            display_row["Cached prompt tokens"] = row["cached_prompt_tokens"]
+            display_row["Completion tokens"] = row["completion_tokens"]
+            if row["hedged_requests"] or row["hedge_wins"]:
+                display_row["Hedge rate"] = "" if row["hedge_rate"] is None else f"{row['hedge_rate']:.0%}"
+                display_row["Hedges"] = row["hedges"]
+                display_row["Failovers"] = row["failovers"]
+                display_row["Hedge wins"] = row["hedge_wins"]
+            if "estimated_cost" in row:
+                display_row["Est. cost ($)"] = f"{row['estimated_cost']:.4f}"
+            table.append(display_row)
+        st.dataframe(table, hide_index=True)
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.download_button(
+                label="📥 Export JSON",
+                data=partial(metrics.to_json, model_prices),
+                file_name=f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime="application/json",
+                key="download_metrics_json",
+                on_click="ignore"
+            )
+        with col2:
+            st.download_button(
+                label="📥 Export Prometheus",
+                data=metrics.to_prometheus,
+                file_name="metrics.prom",
+                mime="text/plain",
+                key="download_metrics_prometheus",
+                on_click="ignore"
+            )
+        with col3:
+            if st.button("Reset Metrics"):
+                metrics.reset()
+                st.rerun()
+
 with tab_settings:
     st.title("Settings")
     
     # Provider selection
     provider = st.selectbox(
         "Select AI Provider", 
-        ["OpenAI", "Gemini", "OpenRouter"], 
+        API_PROVIDERS, 
         key="selected_api_provider",
-        index=["OpenAI", "Gemini", "OpenRouter"].index(st.session_state.get('api_provider', 'OpenAI'))
+        index=API_PROVIDERS.index(st.session_state.get('api_provider', 'OpenAI'))
     )
 
     # API Key input
@@ -477,17 +528,208 @@ with tab_settings:
             value=st.session_state.get('model', '')
         )
 
+    # Batch concurrency
+    max_concurrency = st.number_input(
+        "Max concurrent requests per batch:",
+        min_value=1,
+        max_value=16,
+        step=1,
+        key="selected_max_concurrency",
+        value=int(st.session_state.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+    )
+
+    # Rate limits for the selected provider
+    st.subheader("Rate Limits")
+    current_limits = provider_rate_limits({"rate_limits": st.session_state.get('rate_limits', DEFAULT_RATE_LIMITS)}, provider)
+    requests_per_minute = st.number_input(
+        f"{provider} requests per minute (0 = unlimited):",
+        min_value=0,
+        step=10,
+        key=f"selected_requests_per_minute_{provider}",
+        value=int(current_limits["requests_per_minute"])
+    )
+    tokens_per_minute = st.number_input(
+        f"{provider} tokens per minute (0 = unlimited):",
+        min_value=0,
+        step=10000,
+        key=f"selected_tokens_per_minute_{provider}",
+        value=int(current_limits["tokens_per_minute"])
+    )
+    max_retries = st.number_input(
+        "Retries for throttled or failed requests:",
+        min_value=0,
+        max_value=10,
+        step=1,
+        key="selected_max_retries",
+        value=int(st.session_state.get('max_retries', DEFAULT_MAX_RETRIES))
+    )
+    st.caption("Requests are paced to these budgets, retried with backoff (honouring Retry-After), and concurrency is reduced automatically while the provider is throttling.")
+
+    # Fallback providers, tried in order when a request fails (and for hedging)
+    st.subheader("Failover & Hedging")
+    saved_fallbacks = st.session_state.get('fallback_providers', [])
+    fallback_providers = []
+    for idx in range(MAX_FALLBACK_PROVIDERS):
+        saved = saved_fallbacks[idx] if idx < len(saved_fallbacks) else {}
+        fallback_options = ["None"] + API_PROVIDERS
+        with st.expander(f"Fallback {idx+1}: {saved.get('api_provider', 'None')} {saved.get('model', '')}".strip()):
+            fallback_provider = st.selectbox(
+                "Provider",
+                fallback_options,
+                key=f"selected_fallback_provider_{idx}",
+                index=fallback_options.index(saved.get('api_provider', 'None'))
+            )
+            fallback_key = st.text_input("API Key", type="password", key=f"selected_fallback_key_{idx}", value=saved.get('api_key', ''))
+            fallback_model = st.text_input("Model", key=f"selected_fallback_model_{idx}", value=saved.get('model', ''))
+        if fallback_provider != "None" and fallback_key and fallback_model:
+            fallback_providers.append({"api_provider": fallback_provider, "api_key": fallback_key, "model": fallback_model})
+    hedging_enabled = st.checkbox(
+        "Hedge slow requests",
+        key="selected_hedging_enabled",
+        value=st.session_state.get('hedging_enabled', False),
+        help="Sends a duplicate of a request that is taking unusually long to the next fallback provider, and uses whichever valid response arrives first. Costs extra tokens for hedged requests."
+    )
+    hedge_quantile = st.slider(
+        "Hedge after this percentile of recent latencies:",
+        min_value=0.5,
+        max_value=0.99,
+        step=0.01,
+        key="selected_hedge_quantile",
+        value=float(st.session_state.get('hedge_quantile', DEFAULT_HEDGE_QUANTILE))
+    )
+    hedge_delay_seconds = st.number_input(
+        f"Hedge delay until {st.session_state.get('hedge_min_samples', DEFAULT_HEDGE_MIN_SAMPLES)} calls have been measured (seconds):",
+        min_value=1,
+        step=1,
+        key="selected_hedge_delay_seconds",
+        value=int(st.session_state.get('hedge_delay_seconds', DEFAULT_HEDGE_DELAY_SECONDS))
+    )
+    st.caption("Failed requests always fail over to the fallbacks in order. Hedge rate and wins are shown on the Metrics tab.")
+
+    batch_mode = st.selectbox(
+        "Batch mode",
+        BATCH_MODES,
+        key="selected_batch_mode",
+        index=BATCH_MODES.index(st.session_state.get('batch_mode', 'Per variation')),
+        help="'Single request' asks for all variations and their descriptions as JSON in one or two calls instead of two calls per variation. Scripts are not streamed in this mode."
+    )
+
+    repair_segments = st.checkbox(
+        "Fix timing problems by regenerating only the affected rows",
+        key="selected_repair_segments",
+        value=st.session_state.get('repair_segments', True),
+        help="Checks each script's timestamps, total length and voiceover pace, and asks the model to rewrite just the rows that fail instead of the whole script."
+    )
+    max_words_per_second = st.number_input(
+        "Maximum voiceover words per second:",
+        min_value=1.0,
+        max_value=6.0,
+        step=0.1,
+        key="selected_max_words_per_second",
+        value=float(st.session_state.get('max_words_per_second', DEFAULT_MAX_WORDS_PER_SECOND))
+    )
+
+    dedupe_variations = st.checkbox(
+        "Regenerate near-duplicate variations",
+        key="selected_dedupe_variations",
+        value=st.session_state.get('dedupe_variations', True),
+        help="Compares the variations of each batch and asks again, with a different hook, for any that repeat an earlier one."
+    )
+    duplicate_similarity = st.slider(
+        "Similarity at which variations count as duplicates:",
+        min_value=0.3,
+        max_value=0.95,
+        step=0.05,
+        key="selected_duplicate_similarity",
+        value=float(st.session_state.get('duplicate_similarity', DUPLICATE_SIMILARITY))
+    )
+
+    stream_output = st.checkbox(
+        "Stream scripts as they are generated",
+        key="selected_stream_output",
+        value=st.session_state.get('stream_output', True),
+        help="Shows table rows as they arrive and stops generation once the final row for the selected video length is received."
+    )
+
+    # Response cache
+    st.subheader("Response Cache")
+    cache_enabled = st.checkbox(
+        "Reuse cached responses for identical requests",
+        key="selected_cache_enabled",
+        value=st.session_state.get('cache_enabled', True)
+    )
+    cache_ttl_hours = st.number_input(
+        "Cache entry lifetime (hours, 0 = never expire):",
+        min_value=0,
+        step=1,
+        key="selected_cache_ttl_hours",
+        value=int(st.session_state.get('cache_ttl_hours', DEFAULT_CACHE_TTL_HOURS))
+    )
+    cache_max_entries = st.number_input(
+        "Maximum cached responses (0 = unlimited):",
+        min_value=0,
+        step=100,
+        key="selected_cache_max_entries",
+        value=int(st.session_state.get('cache_max_entries', DEFAULT_CACHE_MAX_ENTRIES))
+    )
+    cache_stats = get_session_response_cache().stats()
+    st.caption(f"Cache hits: {cache_stats['hits']} · misses: {cache_stats['misses']} · stored responses: {cache_stats['entries']}")
+    if st.button("Clear Cache"):
+        get_session_response_cache().clear()
+        st.success("Response cache cleared.")
+
     if st.button("Save Settings"):
         st.session_state.api_provider = provider
         st.session_state.api_key = api_key
         st.session_state.model = model
+        st.session_state.max_concurrency = int(max_concurrency)
+        st.session_state.stream_output = stream_output
+        st.session_state.batch_mode = batch_mode
+        st.session_state.cache_enabled = cache_enabled
+        st.session_state.cache_ttl_hours = int(cache_ttl_hours)
+        st.session_state.cache_max_entries = int(cache_max_entries)
+        st.session_state.max_retries = int(max_retries)
+        rate_limits = dict(st.session_state.get('rate_limits', DEFAULT_RATE_LIMITS))
+        rate_limits[provider] = {
+            "requests_per_minute": int(requests_per_minute),
+            "tokens_per_minute": int(tokens_per_minute)
+        }
+        st.session_state.rate_limits = rate_limits
+        st.session_state.fallback_providers = fallback_providers
+        st.session_state.hedging_enabled = hedging_enabled
+        st.session_state.hedge_quantile = float(hedge_quantile)
+        st.session_state.hedge_delay_seconds = int(hedge_delay_seconds)
+        st.session_state.repair_segments = repair_segments
+        st.session_state.max_words_per_second = float(max_words_per_second)
+        st.session_state.dedupe_variations = dedupe_variations
+        st.session_state.duplicate_similarity = float(duplicate_similarity)
         
         settings_to_save = {
             "api_provider": provider,
             "api_key": api_key,
-            "model": model
+            "model": model,
+            "max_concurrency": int(max_concurrency),
+            "stream_output": stream_output,
+            "batch_mode": batch_mode,
+            "cache_enabled": cache_enabled,
+            "cache_ttl_hours": int(cache_ttl_hours),
+            "cache_max_entries": int(cache_max_entries),
+            "max_retries": int(max_retries),
+            "rate_limits": rate_limits,
+            "model_prices": st.session_state.get('model_prices', DEFAULT_MODEL_PRICES),
+            "fallback_providers": fallback_providers,
+            "hedging_enabled": hedging_enabled,
+            "hedge_quantile": float(hedge_quantile),
+            "hedge_min_samples": st.session_state.get('hedge_min_samples', DEFAULT_HEDGE_MIN_SAMPLES),
+            "hedge_delay_seconds": int(hedge_delay_seconds),
+            "repair_segments": repair_segments,
+            "max_words_per_second": float(max_words_per_second),
+            "dedupe_variations": dedupe_variations,
+            "duplicate_similarity": float(duplicate_similarity)
         }
         save_settings(settings_to_save)
+        # Drop pooled clients built with the old key/model
+        clear_clients()
         st.success("Settings saved successfully!")
 
     st.info("Your settings are saved locally in settings.json and will be loaded next time.") 
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""Local stand-in for an OpenAI-compatible chat completions API.
+
+Answers POST /v1/chat/completions (streaming and non-streaming, with or without JSON mode) with
+canned markdown-table scripts sized to the requested video length, after a configurable latency
+with jitter, and fails a configurable share of requests with 429 or 500. Like OpenAI's automatic
+prompt caching, it reports cached prompt tokens when a request repeats a system prompt (and
+prompt_cache_key) it has already seen. Used by the benchmarks, and handy for trying the app
+without an API key:
+
+    python -m benchmarks.mock_server --port 8799 --latency 0.8 --jitter 0.3
+    OPENAI_BASE_URL=http://127.0.0.1:8799/v1 streamlit run app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VIDEO_LENGTH_RE = re.compile(r"Create a (\d+)-second")
+N_VARIATIONS_RE = re.compile(r"Write (\d+) clearly different variations")
+REPAIR_ROW_RE = re.compile(r"Timestamp (\d+:\d{2}-\d+:\d{2}), at most (\d+) words")
+SEGMENT_SECONDS = 5
+# OpenAI caches prompt prefixes in 128-token increments
+CACHE_INCREMENT_TOKENS = 128
+# Voiceover words are drawn from here so that separate replies are not near-duplicates
+VOICEOVER_WORDS = (
+    "korang tahu tak kenapa benda ni jadi macam tu sebenarnya ada sebab saintifik yang best gila "
+    "cuba bayangkan kalau hari hari kita buat camni mesti lain punya result orang ramai tak perasan "
+    "fakta menarik pasal otak badan makanan air tidur duit kerja sekolah kawan keluarga"
+).split()
+DESCRIPTION = "Description: Fakta best gila yang korang kena tahu!\nHashtags: #fyp #fakta #tiktokmalaysia"
+
+
+def canned_script(video_length, words_per_row=12, rng=None):
+    """A script table with one row per SEGMENT_SECONDS up to video_length. With rng (a random.Random),
+    the Voiceover words are random; without, every call returns the same script."""
+    lines = [
+        "| Timestamp | Visual | Text Overlay | Voiceover |",
+        "| --- | --- | --- | --- |"
+    ]
+    for start in range(0, video_length, SEGMENT_SECONDS):
+        end = min(start + SEGMENT_SECONDS, video_length)
+        filler = rng.choices(VOICEOVER_WORDS, k=words_per_row - 2) if rng else ["wey"] * (words_per_row - 2)
+        voiceover = " ".join(filler + ["follow", "aku!"])
+        lines.append(
+            f"| {start // 60}:{start % 60:02d}-{end // 60}:{end % 60:02d} | [Speaker cakap kat kamera] "
+            f"| Segmen {start // SEGMENT_SECONDS + 1} | \"{voiceover}\" |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def canned_reply(body, words_per_row=12, rng=None):
+    """Picks the reply text for a chat completions request body; rng is passed to canned_script."""
+    prompt = body.get("messages", [{}])[-1].get("content", "")
+    if "Script:" in prompt and "Description" in prompt:
+        return DESCRIPTION
+    if "Rows to rewrite:" in prompt:
+        # Segment repairs get rows that respect the requested timestamps and word limits
+        return "\n".join(
+            f"| {timestamp} | [Speaker cakap kat kamera] | Baiki | \"{' '.join(['wey'] * min(int(words), 8))}\" |"
+            for timestamp, words in REPAIR_ROW_RE.findall(prompt)
+        )
+    match = VIDEO_LENGTH_RE.search(prompt)
+    video_length = int(match.group(1)) if match else 30
+    variations = N_VARIATIONS_RE.search(prompt)
+    if variations:
+        return json.dumps({"variations": [
+            {"script": canned_script(video_length, words_per_row, rng), "description": "Fakta best gila!", "hashtags": "#fyp #fakta"}
+            for _ in range(int(variations.group(1)))
+        ]})
+    return f"Ni script untuk korang:\n\n{canned_script(video_length, words_per_row, rng)}\nSemoga membantu!"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        server.log_request(body)
+        time.sleep(server.next_latency())
+        if server.rng_random() < server.error_rate:
+            if server.rng_random() < 0.5:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                               {"Retry-After": str(server.retry_after)})
+            else:
+                self.send_json(500, {"error": {"message": "Internal error", "type": "server_error"}})
+            return
+
+        text = canned_reply(body, server.words_per_row, server.script_rng())
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        completion_tokens = len(text) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": server.cached_tokens(body, prompt_tokens)}
+        }
+        model = body.get("model", "mock")
+        if not body.get("stream"):
+            self.send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for start in range(0, len(text), server.chunk_chars):
+                self.send_event({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text[start:start + server.chunk_chars]},
+                                 "finish_reason": None}]
+                })
+                time.sleep(server.chunk_delay)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self.send_event({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [], "usage": usage
+                })
+            # [DONE] and the end of the body go out in one write: the SDK closes the response as soon
+            # as it reads [DONE], and an end marker still in flight would reset the connection
+            done = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early, which the app does once the last row has arrived
+            self.close_connection = True
+
+    def send_event(self, payload):
+        self.send_chunk(b"data: " + json.dumps(payload).encode() + b"\n\n")
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded mock server; use as a context manager to run it in the background.
+
+    latency is the mean delay before a response starts, with uniform jitter of +/- jitter seconds.
+    Streamed replies send chunk_chars characters every chunk_delay seconds. error_rate is the share
+    of requests answered with a 429 (with Retry-After: retry_after) or a 500, half each.
+    Prompts of at least cache_min_tokens (OpenAI's minimum is 1024; the default is lower so the
+    app's prompts, as counted by this mock, qualify) get their repeated system prompt reported as
+    cached. Scripts have words_per_row Voiceover words per five-second row; more than 15 is too
+    fast to speak and makes every row fail timing validation. A duplicate_rate share of replies
+    repeat the same script, and the rest get random Voiceover words. The last 1000 request bodies are
+    kept in request_bodies for checking request shapes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.5, jitter=0.0, error_rate=0.0, chunk_chars=16, chunk_delay=0.01,
+                 retry_after=0.1, seed=None, cache_min_tokens=512, words_per_row=12, duplicate_rate=0.0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.retry_after = retry_after
+        self.cache_min_tokens = cache_min_tokens
+        self.words_per_row = words_per_row
+        self.duplicate_rate = duplicate_rate
+        self.requests = 0
+        self.request_bodies = deque(maxlen=1000)
+        self._prefixes = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def rng_random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def script_rng(self):
+        """A random.Random for one reply's script, or None for a duplicate."""
+        with self._lock:
+            if self._rng.random() < self.duplicate_rate:
+                return None
+            return random.Random(self._rng.random())
+
+    def next_latency(self):
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def log_request(self, body):
+        with self._lock:
+            self.requests += 1
+            self.request_bodies.append(body)
+
+    def cached_tokens(self, body, prompt_tokens):
+        """Prompt tokens to report as cached: the system prompt, rounded down to the cache increment,
+        if an earlier request already sent the same system prompt and prompt_cache_key."""
+        messages = body.get("messages") or [{}]
+        if messages[0].get("role") != "system":
+            return 0
+        prefix = (messages[0].get("content", ""), body.get("prompt_cache_key"))
+        with self._lock:
+            seen = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        if not seen or prompt_tokens < self.cache_min_tokens:
+            return 0
+        return min(prompt_tokens, len(prefix[0]) // 4 // CACHE_INCREMENT_TOKENS * CACHE_INCREMENT_TOKENS)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat completions server.")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--latency", type=float, default=0.5, help="mean seconds before a response starts")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter on the latency, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with 429 or 500")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="seconds between streamed chunks")
+    parser.add_argument("--seed", type=int, help="random seed for jitter and errors")
+    parser.add_argument("--cache-min-tokens", type=int, default=512, help="smallest prompt reported as prompt-cached")
+    parser.add_argument("--words-per-row", type=int, default=12, help="Voiceover words per five-second script row")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="share of replies that repeat the same script")
+    args = parser.parse_args(argv)
+    server = MockServer(
+        args.port, args.latency, args.jitter, args.error_rate, chunk_delay=args.chunk_delay, seed=args.seed,
+        cache_min_tokens=args.cache_min_tokens, words_per_row=args.words_per_row, duplicate_rate=args.duplicate_rate
+    )
+    print(f"Mock server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Benchmarks for batch generation and the script table parser/exporters.
+
+End-to-end benchmarks run real batches through generation.run_batch (the core of the app's
+background batch jobs) against the local mock server in benchmarks/mock_server.py, at several
+concurrency levels, with and without live row updates. Microbenchmarks time the table parser and the
+Excel/TXT exporters and the timing validator on large synthetic scripts, and the history similarity
+lookups on a store of --micro-history scripts. Startup benchmarks (benchmarks/startup.py) time
+the app's first run, a rerun and each module's import. Results are compared against baselines.json and
+the run fails if any result is worse than its baseline by more than the tolerance.
+
+    python -m benchmarks.run                  # run everything and compare against the baselines
+    python -m benchmarks.run --only micro     # just the parser/exporter microbenchmarks
+    python -m benchmarks.run --only startup   # just cold start, rerun and import times
+    python -m benchmarks.run --save-baseline  # record the results as the new baselines
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from time import perf_counter
+
+from exports import extract_voiceover_txt, items_to_voiceover_zip, items_to_xlsx, script_to_xlsx
+from generation import run_batch
+from history_store import HistoryStore
+from metrics import get_metrics
+from script_table import parse_script_table, validate_script_timing
+from settings import provider_config
+from similarity import script_signature
+
+from benchmarks.mock_server import MockServer, canned_script
+from benchmarks.startup import run_startup_benchmarks
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_CONCURRENCY_LEVELS = [1, 4, 8]
+
+
+def benchmark_config(server_url, concurrency, max_retries):
+    """Provider config pointing at the mock server, with no rate limits.
+
+    Each concurrency level gets its own API key so it starts with a fresh limiter and client.
+    """
+    config = provider_config({
+        "api_provider": "OpenAI",
+        "api_key": f"benchmark-{concurrency}",
+        "model": "mock-model",
+        "max_concurrency": concurrency,
+        "max_retries": max_retries,
+        "rate_limits": {"OpenAI": {"requests_per_minute": 0, "tokens_per_minute": 0}}
+    })
+    config["base_url"] = server_url
+    return config
+
+
+def time_batch(config, video_length, n_variations, concurrency, updates):
+    """Runs one batch, with on_update if updates, and returns (seconds, seconds to the first streamed
+    row or None, scripts generated)."""
+    first_row = []
+    start = perf_counter()
+
+    def on_update(idx, text):
+        if not first_row:
+            first_row.append(perf_counter() - start)
+
+    results = run_batch(
+        config, "benchmark", video_length, None, n_variations, concurrency,
+        on_update=on_update if updates else None
+    )
+    elapsed = perf_counter() - start
+    return elapsed, (first_row[0] if first_row else None), sum(1 for script, _, _ in results if script)
+
+
+def run_batch_benchmarks(args):
+    """Returns {name: value} for every concurrency level, with live row updates ("stream") and without
+    ("no_updates"). Every request is streamed either way; without updates no rows are shown early."""
+    results = {}
+    server = MockServer(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        chunk_delay=args.chunk_delay, seed=args.seed
+    )
+    with server:
+        for updates in (True, False):
+            mode = "stream" if updates else "no_updates"
+            for concurrency in args.concurrency:
+                config = benchmark_config(server.url, concurrency, args.max_retries)
+                get_metrics().reset()
+                # One untimed batch warms up the connection pool
+                time_batch(config, args.video_length, args.variations, concurrency, updates)
+                get_metrics().reset()
+                timings = []
+                first_rows = []
+                scripts = 0
+                for _ in range(args.batches):
+                    elapsed, first_row, generated = time_batch(
+                        config, args.video_length, args.variations, concurrency, updates
+                    )
+                    timings.append(elapsed)
+                    scripts += generated
+                    if first_row is not None:
+                        first_rows.append(first_row)
+                name = f"batch.{mode}.c{concurrency}"
+                results[f"{name}.throughput_scripts_per_s"] = scripts / sum(timings)
+                results[f"{name}.batch_p50_s"] = statistics.median(timings)
+                results[f"{name}.batch_max_s"] = max(timings)
+                if first_rows:
+                    results[f"{name}.first_row_p50_s"] = statistics.median(first_rows)
+                for row in get_metrics().summary():
+                    if row["kind"] == "script":
+                        results[f"{name}.script_call_p95_s"] = row["latency_p95"]
+                        results[f"{name}.script_call_p99_s"] = row["latency_p99"]
+                        if not updates:
+                            # Streams shown row by row stop at the last row, before the usage chunk
+                            results[f"{name}.cached_prompt_share"] = row["cached_prompt_share"]
+                print(f"  {name}: {results[f'{name}.throughput_scripts_per_s']:.2f} scripts/s, "
+                      f"batch p50 {results[f'{name}.batch_p50_s']:.2f}s", file=sys.stderr)
+        check_prompt_prefixes(server.request_bodies)
+    return results
+
+
+def check_prompt_prefixes(bodies):
+    """Warns if requests don't lead with a system message, or if more distinct system prompts were
+    sent than the app uses (one for scripts, one for descriptions): either defeats prompt caching."""
+    system_prompts = set()
+    for body in bodies:
+        messages = body.get("messages") or [{}]
+        if messages[0].get("role") != "system":
+            print("  warning: a request did not start with a system message", file=sys.stderr)
+            return
+        system_prompts.add(messages[0].get("content"))
+    if len(system_prompts) > 2:
+        print(f"  warning: {len(system_prompts)} different system prompts were sent", file=sys.stderr)
+
+
+def run_micro_benchmarks(args):
+    """Returns {name: best seconds per call} for the parser and exporters."""
+    big_script = f"Ni script panjang:\n\n{canned_script(args.micro_rows * 5, words_per_row=30)}\nSekian."
+    items = [
+        {
+            'timestamp': datetime(2024, 1, 1),
+            'topic': f"Topik {number}",
+            'video_length': 60,
+            'avatar': None,
+            'script': canned_script(60),
+            'description': "Description: x\nHashtags: #fyp"
+        }
+        for number in range(args.micro_items)
+    ]
+
+    def extract_uncached():
+        parse_script_table.cache_clear()
+        extract_voiceover_txt(big_script)
+
+    cases = {
+        f"micro.parse_table_{args.micro_rows}_rows_s": lambda: parse_script_table.__wrapped__(big_script),
+        f"micro.script_to_xlsx_{args.micro_rows}_rows_s": lambda: script_to_xlsx.__wrapped__(big_script),
+        f"micro.voiceover_txt_{args.micro_rows}_rows_s": extract_uncached,
+        f"micro.validate_timing_{args.micro_rows}_rows_s": lambda: validate_script_timing(big_script, args.micro_rows * 5),
+        f"micro.items_to_xlsx_{args.micro_items}_items_s": lambda: items_to_xlsx(items),
+        f"micro.voiceover_zip_{args.micro_items}_items_s": lambda: items_to_voiceover_zip(items)
+    }
+    cases[f"micro.script_signature_{args.micro_rows}_rows_s"] = lambda: script_signature(big_script)
+    results = {}
+
+    def time_cases(cases):
+        for name, fn in cases.items():
+            results[name] = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+            print(f"  {name}: {results[name] * 1000:.1f} ms", file=sys.stderr)
+
+    time_cases(cases)
+    with tempfile.TemporaryDirectory() as tmp:
+        # A history of distinct scripts, so the lookups measure the index rather than one huge match
+        store = HistoryStore(os.path.join(tmp, "history.db"))
+        rng = random.Random(args.micro_history)
+        topic_words = "kucing anjing tidur makan air otak duit kerja sekolah kopi hujan laut".split()
+        for number in range(args.micro_history):
+            store.add(" ".join(rng.sample(topic_words, 3)), 60, canned_script(60, rng=rng))
+        probe = canned_script(60, rng=rng)
+        time_cases({
+            f"micro.similar_topics_{args.micro_history}_items_s": lambda: store.similar_topics("kenapa kucing suka tidur"),
+            f"micro.similar_scripts_{args.micro_history}_items_s": lambda: store.similar_scripts(probe)
+        })
+        store._conn.close()
+    return results
+
+
+def higher_is_better(name):
+    return "throughput" in name or "cached" in name
+
+
+def compare(results, baselines, tolerance):
+    """Prints each result next to its baseline and returns the names that regressed."""
+    regressions = []
+    for name in sorted(results):
+        value = results[name]
+        baseline = baselines.get(name)
+        if value is None:
+            continue
+        if baseline is None:
+            print(f"{name:<55} {value:>12.4f}  (no baseline)")
+            continue
+        change = (value - baseline) / baseline if baseline else 0.0
+        if higher_is_better(name):
+            regressed = value < baseline * (1 - tolerance)
+        else:
+            regressed = value > baseline * (1 + tolerance)
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<55} {value:>12.4f}  baseline {baseline:>10.4f}  {change:>+7.1%}  {flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("results", {})
+
+
+def save_baselines(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark batch generation and the parser/exporters.")
+    parser.add_argument("--only", choices=["batch", "micro", "startup"], help="run only one group of benchmarks")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare against or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown relative to the baseline before failing (0.25 = 25%%)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY_LEVELS,
+                        help="concurrency levels for the batch benchmarks")
+    parser.add_argument("--batches", type=int, default=3, help="timed batches per concurrency level")
+    parser.add_argument("--variations", type=int, default=7, help="variations per batch")
+    parser.add_argument("--video-length", type=int, default=30, choices=[15, 30, 60])
+    parser.add_argument("--latency", type=float, default=0.2, help="mock server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="mock server latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock requests that fail with 429/500")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1234, help="random seed for the mock server")
+    parser.add_argument("--micro-rows", type=int, default=2000, help="rows in the synthetic script for microbenchmarks")
+    parser.add_argument("--micro-items", type=int, default=200, help="scripts in the bulk export microbenchmarks")
+    parser.add_argument("--micro-history", type=int, default=5000, help="scripts in history for the similarity lookup microbenchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per microbenchmark (best is kept)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = {}
+    if args.only in (None, "startup"):
+        print("Startup benchmarks:", file=sys.stderr)
+        results.update(run_startup_benchmarks())
+    if args.only in (None, "micro"):
+        print("Microbenchmarks:", file=sys.stderr)
+        results.update(run_micro_benchmarks(args))
+    if args.only in (None, "batch"):
+        print("Batch benchmarks:", file=sys.stderr)
+        results.update(run_batch_benchmarks(args))
+
+    if args.save_baseline:
+        # Keep baselines for the groups that weren't run this time
+        baselines = load_baselines(args.baseline)
+        baselines.update(results)
+        save_baselines(args.baseline, baselines)
+        print(f"Saved {len(results)} baseline(s) to {args.baseline}", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, load_baselines(args.baseline), args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
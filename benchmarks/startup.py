@@ -0,0 +1,122 @@
+"""Cold-start and rerun timings for the Streamlit app, and an import-time report.
+
+Every measurement runs in a fresh interpreter, so nothing is already imported. The report lists
+how long each app module takes to import (including its dependencies), the heaviest imports
+overall, how long the first run and a rerun of app.py take, and which heavy optional packages
+were loaded by the first run (ideally none until a provider call or export needs them).
+
+    python -m benchmarks.startup
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_DIR, "app.py")
+APP_MODULES = [
+    "settings", "generation", "exports", "hedging", "history_store", "jobs", "metrics", "rate_limit",
+    "response_cache", "script_table", "similarity"
+]
+# Packages that should only be imported when they are needed
+LAZY_MODULES = ["openai", "google.generativeai", "openpyxl", "pandas"]
+
+APP_RUN_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+framework = time.perf_counter() - start
+app = AppTest.from_file({app_file!r}, default_timeout=120)
+start = time.perf_counter()
+app.run()
+cold = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - start
+print(json.dumps({{
+    "framework": framework, "cold": cold, "rerun": rerun, "exception": len(app.exception) > 0,
+    "loaded": [name for name in {lazy_modules!r} if name in sys.modules]
+}}))
+"""
+
+
+def run_python(args, cwd=REPO_DIR):
+    """Runs the current interpreter with args, with the repo importable, and returns the finished process."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+
+
+def import_times(modules):
+    """Imports modules in a fresh interpreter with -X importtime.
+
+    Returns [(name, self_seconds, cumulative_seconds, depth)] for every module that was imported,
+    in import order, including the ones the interpreter imports at startup. Depth 0 entries were
+    imported at the top level.
+    """
+    process = run_python(["-X", "importtime", "-c", f"import {', '.join(modules)}" if modules else "pass"])
+    entries = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return entries
+
+
+def module_import_time(module):
+    """Seconds to import module, including everything it imports, in a fresh interpreter."""
+    for name, _, cumulative, depth in import_times([module]):
+        if name == module and depth == 0:
+            return cumulative
+    return 0.0
+
+
+def app_run_times():
+    """Runs app.py twice with Streamlit's AppTest in a fresh interpreter and a scratch working directory
+    (so no settings or history are touched). Returns the timings and the lazy modules that were loaded."""
+    with tempfile.TemporaryDirectory() as scratch:
+        script = APP_RUN_SCRIPT.format(app_file=APP_FILE, lazy_modules=LAZY_MODULES)
+        process = run_python(["-c", script], cwd=scratch)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_startup_benchmarks():
+    """Returns {name: seconds} for the app's cold start, a rerun and every app module's import."""
+    results = {}
+    app = app_run_times()
+    results["startup.app_cold_run_s"] = app["cold"]
+    results["startup.app_rerun_s"] = app["rerun"]
+    for module in APP_MODULES:
+        results[f"startup.import_{module}_s"] = module_import_time(module)
+    if app["loaded"]:
+        print(f"  warning: the first run loaded {', '.join(app['loaded'])}", file=sys.stderr)
+    return results
+
+
+def main():
+    print("Import time per app module (cumulative, fresh interpreter):")
+    for module in APP_MODULES:
+        print(f"  {module:<16} {module_import_time(module) * 1000:8.1f} ms")
+
+    # Leave out what the interpreter imports before running any code
+    startup_modules = {entry[0] for entry in import_times([])}
+    entries = [entry for entry in import_times(APP_MODULES) if entry[0] not in startup_modules]
+    top_level = sorted((entry for entry in entries if entry[3] <= 1), key=lambda entry: entry[2], reverse=True)
+    print("\nHeaviest imports when loading every app module:")
+    for name, _, cumulative, _ in top_level[:10]:
+        print(f"  {name:<40} {cumulative * 1000:8.1f} ms")
+
+    app = app_run_times()
+    print("\napp.py under streamlit.testing.AppTest:")
+    print(f"  import streamlit testing {app['framework'] * 1000:8.1f} ms")
+    print(f"  first run (cold)        {app['cold'] * 1000:8.1f} ms")
+    print(f"  rerun                   {app['rerun'] * 1000:8.1f} ms")
+    print(f"  lazy packages loaded    {', '.join(app['loaded']) or 'none'}")
+    if app["exception"]:
+        print("  the app raised an exception; run it with streamlit to see it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Headless bulk generation.
+
+Reads jobs from a CSV or JSONL file with topic, video_length, avatar and n_variations columns and
+appends one JSON line per finished job to the output file. Finished jobs are recorded in the output
+file itself, so rerunning the same command after a crash or Ctrl+C resumes where it stopped.
+
+    python cli.py jobs.csv -o results.jsonl --xlsx results.xlsx --concurrency 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from exports import items_to_xlsx
+from generation import BATCH_MODES, collect_batch, regenerate_duplicates, submit_batch, variation_avatars
+from history_store import HistoryStore
+from metrics import get_metrics
+from settings import (
+    DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_TTL_HOURS, HISTORY_DB_FILE, SETTINGS_FILE,
+    load_settings, open_response_cache, provider_config
+)
+
+DEFAULT_N_VARIATIONS = 7
+# Variations of unwritten jobs per worker: enough to keep the workers busy between jobs
+QUEUED_VARIATIONS_PER_WORKER = 2
+
+
+def read_jobs(path):
+    """Reads jobs from a .csv or .jsonl file into a list of dicts."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        topic = (row.get('topic') or '').strip()
+        if not topic:
+            raise ValueError(f"Job {number} has no topic.")
+        jobs.append({
+            'topic': topic,
+            'video_length': int(row.get('video_length') or 30),
+            'avatar': (row.get('avatar') or '').strip() or None,
+            'n_variations': int(row.get('n_variations') or DEFAULT_N_VARIATIONS)
+        })
+    return jobs
+
+
+def job_key(index, job):
+    """Identifies a job by its position and content, so an edited input file doesn't skip changed rows."""
+    payload = json.dumps([index, job['topic'], job['video_length'], job['avatar'], job['n_variations']], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_completed(output_path):
+    """Returns the job keys already in the output file, dropping a partial last line left by a killed run."""
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    completed = set()
+    for line in data[:end].splitlines():
+        if line.strip():
+            completed.add(json.loads(line)['job_key'])
+    return completed
+
+
+def iter_output_items(output_path):
+    """Yields one history-style item per generated script in the output file."""
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for variation in record['variations']:
+                if variation['script']:
+                    yield {
+                        'timestamp': record['completed_at'],
+                        'topic': record['topic'],
+                        'video_length': record['video_length'],
+                        'avatar': variation['avatar'],
+                        'script': variation['script'],
+                        'description': variation['description']
+                    }
+
+
+def write_metrics(path, settings):
+    """Writes the metrics collected during the run as Prometheus text (.prom) or JSON."""
+    metrics = get_metrics()
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.lower().endswith('.prom'):
+            f.write(metrics.to_prometheus())
+        else:
+            f.write(metrics.to_json(settings.get("model_prices")))
+    print(f"Wrote {path}", file=sys.stderr)
+
+
+def write_job(output, history, config, index, job, results, progress):
+    """Appends a finished job to the output file as one checkpointed line and reports its progress."""
+    avatars = variation_avatars(job['avatar'], job['n_variations'])
+    variations = [
+        {'variation': i + 1, 'avatar': avatars[i], 'script': script, 'description': desc_tag, 'error': error}
+        for i, (script, desc_tag, error) in enumerate(results)
+    ]
+    completed_at = datetime.now()
+    record = {
+        'job': index,
+        'job_key': job_key(index, job),
+        'topic': job['topic'],
+        'video_length': job['video_length'],
+        'avatar': job['avatar'],
+        'provider': config['api_provider'],
+        'model': config['model'],
+        'completed_at': completed_at.isoformat(sep=' ', timespec='seconds'),
+        'variations': variations
+    }
+    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+    output.flush()
+    os.fsync(output.fileno())
+    if history:
+        for variation in variations:
+            if variation['script']:
+                history.add(
+                    job['topic'], job['video_length'], variation['script'], avatar=variation['avatar'],
+                    timestamp=completed_at, description=variation['description'],
+                    provider=config['api_provider'], model=config['model']
+                )
+    succeeded = sum(1 for variation in variations if variation['script'])
+    print(f"[{progress}] {job['topic']} ({job['video_length']}s): "
+          f"{succeeded}/{job['n_variations']} variation(s)", file=sys.stderr)
+    for variation in variations:
+        if variation['error']:
+            print(f"    Variation {variation['variation']}: {variation['error']}", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Generate TikTok scripts in bulk without the Streamlit UI.")
+    parser.add_argument("jobs", help="CSV or JSONL file with topic, video_length, avatar and n_variations")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to (also the resume checkpoint)")
+    parser.add_argument("--xlsx", help="also write every generated script to this workbook when the run finishes")
+    parser.add_argument("--settings", default=SETTINGS_FILE, help="settings file to read provider, key and model from")
+    parser.add_argument("--provider", choices=["OpenAI", "Gemini", "OpenRouter"], help="override the provider from settings")
+    parser.add_argument("--model", help="override the model from settings")
+    parser.add_argument("--api-key", help="override the API key from settings")
+    parser.add_argument("--concurrency", type=int, help="max requests in flight across all jobs")
+    parser.add_argument("--batch-mode", choices=BATCH_MODES, help="override the batch mode from settings")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    parser.add_argument("--history", action="store_true", help="also add generated scripts to the app's history")
+    parser.add_argument("--metrics", help="write per-call latency/token metrics here when the run ends (.prom for Prometheus text, otherwise JSON)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    settings = load_settings(args.settings)
+    for key, value in (("api_provider", args.provider), ("model", args.model), ("api_key", args.api_key)):
+        if value:
+            settings[key] = value
+    if args.concurrency:
+        settings["max_concurrency"] = args.concurrency
+    config = provider_config(settings)
+    if not config["api_key"] or not config["model"]:
+        print("An API key and model are required (set them in Settings or pass --api-key/--model).", file=sys.stderr)
+        return 2
+
+    cache = None
+    if settings.get("cache_enabled", True) and not args.no_cache:
+        cache = open_response_cache(
+            settings.get("cache_ttl_hours", DEFAULT_CACHE_TTL_HOURS),
+            settings.get("cache_max_entries", DEFAULT_CACHE_MAX_ENTRIES)
+        )
+    history = HistoryStore(HISTORY_DB_FILE) if args.history else None
+    batch_mode = args.batch_mode or settings.get("batch_mode", "Per variation")
+    concurrency = max(1, config["max_concurrency"])
+
+    jobs = read_jobs(args.jobs)
+    completed = load_completed(args.output)
+    pending = [(index, job) for index, job in enumerate(jobs) if job_key(index, job) not in completed]
+    print(f"{len(jobs)} job(s), {len(jobs) - len(pending)} already done, {len(pending)} to run.", file=sys.stderr)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    # Deduping a job waits on its regenerated variations, so it runs here rather than on the writer
+    # loop, which keeps writing other jobs out meanwhile
+    dedupe_executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        with open(args.output, 'a', encoding='utf-8') as output:
+            owners = {}
+            job_futures = {}
+            remaining = {}
+            dedupes = {}
+            waiting = set()
+            queued_variations = 0
+            unsubmitted = iter(pending)
+            done = len(jobs) - len(pending)
+            jobs_by_index = dict(pending)
+            while True:
+                # Jobs are submitted as earlier ones are written out rather than all at once, so the
+                # duplicates a job regenerates only queue behind a few requests, not the whole input file
+                while queued_variations < QUEUED_VARIATIONS_PER_WORKER * concurrency:
+                    index, job = next(unsubmitted, (None, None))
+                    if job is None:
+                        break
+                    futures = submit_batch(
+                        executor, config, job['topic'], job['video_length'], job['avatar'],
+                        job['n_variations'], cache, batch_mode
+                    )
+                    job_futures[index] = futures
+                    remaining[index] = len(futures)
+                    queued_variations += job['n_variations']
+                    for future in futures:
+                        owners[future] = index
+                    waiting.update(futures)
+                if not waiting:
+                    break
+                finished, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in dedupes:
+                        index = dedupes.pop(future)
+                        results = future.result()
+                    else:
+                        index = owners.pop(future)
+                        remaining[index] -= 1
+                        if remaining[index]:
+                            continue
+                        job = jobs_by_index[index]
+                        results = collect_batch(job_futures.pop(index))
+                        if config.get("dedupe_variations"):
+                            dedupe = dedupe_executor.submit(
+                                regenerate_duplicates, executor, config, job['topic'], job['video_length'],
+                                job['avatar'], results, cache
+                            )
+                            dedupes[dedupe] = index
+                            waiting.add(dedupe)
+                            continue
+                    # Every request for this job has finished: write it out as one checkpointed line
+                    done += 1
+                    queued_variations -= jobs_by_index[index]['n_variations']
+                    write_job(output, history, config, index, jobs_by_index[index], results, f"{done}/{len(jobs)}")
+    except KeyboardInterrupt:
+        print("Interrupted; finished jobs are saved and will be skipped on the next run.", file=sys.stderr)
+        dedupe_executor.shutdown(wait=False, cancel_futures=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+        if args.metrics:
+            write_metrics(args.metrics, settings)
+        return 130
+    dedupe_executor.shutdown()
+    executor.shutdown()
+
+    if args.metrics:
+        write_metrics(args.metrics, settings)
+    if args.xlsx:
+        with open(args.xlsx, 'wb') as f:
+            f.write(items_to_xlsx(iter_output_items(args.output)))
+        print(f"Wrote {args.xlsx}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
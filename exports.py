@@ -0,0 +1,127 @@
+import io
+import zipfile
+from functools import lru_cache
+
+from script_table import parse_script_table
+
+MAX_COLUMN_WIDTH = 50
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def column_widths(table):
+    """Returns a width per column that fits its longest value, capped at MAX_COLUMN_WIDTH."""
+    widths = [len(str(header)) for header in table.headers]
+    for row in table.rows:
+        for idx, value in enumerate(row):
+            if len(value) > widths[idx]:
+                widths[idx] = len(value)
+    return [min(width + 2, MAX_COLUMN_WIDTH) for width in widths]
+
+
+def write_script_sheet(workbook, table, title="Script"):
+    """Appends a write-only sheet holding the script table to workbook and closes it.
+
+    Closing flushes the sheet to its temp file straight away, so only one sheet is held open at a time.
+    """
+    from openpyxl.utils import get_column_letter
+
+    worksheet = workbook.create_sheet(title=title)
+    # Write-only sheets need their column widths set before any row is written
+    for idx, width in enumerate(column_widths(table), start=1):
+        worksheet.column_dimensions[get_column_letter(idx)].width = width
+    worksheet.append(list(table.headers))
+    for row in table.rows:
+        worksheet.append(list(row))
+    worksheet.close()
+    return worksheet
+
+
+@lru_cache(maxsize=256)
+def script_to_xlsx(script):
+    """Builds an .xlsx workbook for a script entirely in memory and returns its bytes.
+
+    Memoized on the script text, so repeated downloads and reruns reuse the same bytes. openpyxl is
+    imported on the first export rather than at startup.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    write_script_sheet(workbook, parse_script_table(script))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def extract_voiceover_txt(script):
+    """Extracts the Voiceover column from the markdown table in the script and returns it as plain text."""
+    voiceover_lines = parse_script_table(script).column('Voiceover')
+    if voiceover_lines is None:
+        return None
+    # Remove surrounding quotes if present
+    voiceover_lines = [v.strip('"') for v in voiceover_lines]
+    return '\n'.join(voiceover_lines)
+
+
+SUMMARY_HEADERS = ["#", "Sheet", "Topic", "Length (s)", "Avatar/Persona", "Generated", "Description & Hashtags"]
+SUMMARY_WIDTHS = [6, 31, 40, 11, 40, 20, 80]
+INVALID_SHEET_CHARS = str.maketrans({char: " " for char in "[]:*?/\\"})
+
+
+def sheet_title(number, topic):
+    """Returns a valid, unique Excel sheet title (max 31 chars) for the numbered script."""
+    return f"{number} {topic}".translate(INVALID_SHEET_CHARS).strip()[:31]
+
+
+def format_timestamp(timestamp, fmt='%Y-%m-%d %H:%M:%S'):
+    """Formats a datetime, passing through strings and None."""
+    if timestamp is None or isinstance(timestamp, str):
+        return timestamp or ""
+    return timestamp.strftime(fmt)
+
+
+def items_to_xlsx(items):
+    """Streams many scripts into one workbook and returns its bytes.
+
+    items is an iterable of history-style dicts (topic, video_length, avatar, timestamp, script,
+    description). Each script gets its own sheet, and a Summary sheet lists them all. Uses
+    write-only sheets and skips the parse memo, so memory does not grow with the number of scripts.
+    """
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    summary = workbook.create_sheet(title="Summary")
+    for idx, width in enumerate(SUMMARY_WIDTHS, start=1):
+        summary.column_dimensions[get_column_letter(idx)].width = width
+    summary.append(SUMMARY_HEADERS)
+    for number, item in enumerate(items, start=1):
+        title = sheet_title(number, item['topic'])
+        write_script_sheet(workbook, parse_script_table.__wrapped__(item['script']), title=title)
+        summary.append([
+            number,
+            title,
+            item['topic'],
+            item['video_length'],
+            item.get('avatar') or "",
+            format_timestamp(item.get('timestamp')),
+            item.get('description') or ""
+        ])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def items_to_voiceover_zip(items):
+    """Zips the voiceover of every script in items into one .txt file per script and returns the zip bytes."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for number, item in enumerate(items, start=1):
+            table = parse_script_table.__wrapped__(item['script'])
+            voiceover_lines = table.column('Voiceover')
+            if voiceover_lines is None:
+                continue
+            timestamp = format_timestamp(item.get('timestamp'), '%Y%m%d_%H%M%S')
+            topic = item['topic'].translate(INVALID_SHEET_CHARS).replace(' ', '_')
+            filename = f"{number:03d}_tiktok_voiceover_{topic}_{item['video_length']}s_{timestamp}.txt"
+            archive.writestr(filename, '\n'.join(v.strip('"') for v in voiceover_lines))
+    return buffer.getvalue()
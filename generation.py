@@ -0,0 +1,1166 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from hedging import RaceCancelled, StopEvent, race
+from metrics import CallRecorder, get_metrics
+from rate_limit import get_limiter, is_retryable_error, is_throttle_error
+from response_cache import ResponseCache
+from script_table import (
+    DEFAULT_MAX_WORDS_PER_SECOND, format_table_row, format_timestamp_range, parse_script_table, parse_timestamp_range,
+    plan_segment_windows, replace_table_rows, split_table_row, validate_script_timing
+)
+from settings import DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RETRIES
+from similarity import DUPLICATE_SIMILARITY, find_duplicates
+
+BATCH_MODES = ["Per variation", "Single request"]
+CANCELLED_ERROR = "Cancelled."
+# Output token budget for one structured multi-variation request, and a rough per-variation cost
+STRUCTURED_MAX_OUTPUT_TOKENS = 4096
+STRUCTURED_TOKENS_PER_VARIATION = {15: 450, 30: 750, 60: 1300}
+DESCRIPTION_MAX_TOKENS = 200
+OPENROUTER_HEADERS = {
+    "HTTP-Referer": "http://localhost:8501",
+    "X-Title": "TikTok Script Generator"
+}
+
+# Pooled clients, keyed by (provider, api_key, base_url, model_name)
+_clients = {}
+_clients_lock = threading.Lock()
+# genai.configure() is process-global, so building Gemini clients must be serialized
+_gemini_configure_lock = threading.Lock()
+# When the current worker's task was submitted, so its first provider call can report its queue wait,
+# and the stop event of the attempt it is running (see with_failover)
+_call_context = threading.local()
+
+
+# System prompt from user instructions
+SYSTEM_PROMPT = """Create a TikTok video script for a specified topic, in colloquial Bahasa Malaysia (bahasa pasar/Manglish). Your audience consists of young, inquisitive users eager to learn. Write the script to explain the topic concisely yet comprehensively, capturing attention initially, maintaining interest, and concluding with a call to action.
+
+- **Tone & Style**: Use a casual, conversational tone in colloquial Bahasa Malaysia (bahasa pasar/Manglish). This includes using "kau" or "korang" instead of formal "anda", "tak" instead of "tidak", "je" instead of "saja", "nak" instead of "hendak", "dah" instead of "sudah", and other colloquial features. Incorporate TikTok trends if relevant. Target three potential video lengths: 15 seconds, 30 seconds, or 60 seconds.
+- **Visual Elements**: Include visual cues and overlays to highlight key points. Assume a mix of direct-to-camera and visual overlay parts.
+
+# Steps
+
+1. **Opening**: 
+    - Ensure the first few seconds are engaging.
+    - Provide a hook to grab attention.
+2. **Content**:
+    - Maintain a clear, concise explanation of the topic.
+    - Keep the content engaging and relevant.
+3. **Closing**:
+    - Include a call to action, encouraging further engagement.
+
+# Output Format
+
+- **Table Format**: Present the script in a markdown table with four columns: `Timestamp`, `Visual`, `Text Overlay`, and `Voiceover`.
+- **Language**: The `Text Overlay` and `Voiceover` columns must be in colloquial Bahasa Malaysia (bahasa pasar/Manglish).
+- **Timestamp**: Indicate the start and end time for each segment (e.g., 0:00-0:03).
+- **Visual**: Describe the visual elements of the scene.
+- **Text Overlay**: Write any text that should appear on the screen (in colloquial Bahasa Malaysia).
+- **Voiceover**: Write the spoken words for the script (in colloquial Bahasa Malaysia).
+- **Pacing**: Each Voiceover must be short enough to say within its segment: at most 3 words per second (9 words for a 3-second segment, 15 for a 5-second one).
+
+# Colloquial Bahasa Malaysia Features
+Use these colloquial features in your script:
+- "kau" or "korang" instead of "anda" (you)
+- "tak" instead of "tidak" (not)
+- "je" instead of "saja" (only/just)
+- "nak" instead of "hendak" (want)
+- "dah" instead of "sudah" (already)
+- "sangat" or "gila" instead of "amat" (very)
+- "faham" or "paham" (understand)
+- "boleh" or "leh" (can)
+- "kat" instead of "di" (at/in)
+- "dengan" (with)
+- "ni" instead of "ini" (this)
+- "tu" instead of "itu" (that)
+- "ke" (to)
+- "pada" (at/to)
+- "macam" instead of "seperti" (like)
+- "gila" instead of "sangat" (very/extremely)
+- "wey" or "weh" as interjections
+- "la" or "lah" as sentence endings
+
+# Example
+
+| Timestamp | Visual | Text Overlay | Voiceover |
+| --- | --- | --- | --- |
+| 0:00-0:03 | [Muka speaker nampak teruja] | Korang tahu tak? | "Korang tahu tak perang paling sekejap cuma 38 minit?" |
+| 0:04-0:08 | [Gambar-gambar lama Perang Inggeris-Zanzibar] | 27 Ogos 1896 | "Betul wey! Perang Inggeris-Zanzibar 1896. Kena bedil kapal British, 38 minit je dah surrender." |
+| 0:09-0:15 | [Speaker kembali senyum kat skrin] | #sejarah #faktamenarik | "Nak tahu lagi fakta sejarah gila-gila macam ni? Follow aku!" |
+
+# Notes
+- Ensure the script suits a maximum of 60 seconds in length.
+- Be mindful of creating an engaging narrative flow.
+- Consider using trendy TikTok sound effects or edits where appropriate.
+- Always use colloquial Bahasa Malaysia features consistently throughout the script.
+- Make sure the language sounds natural and conversational, like how young Malaysians actually speak.
+"""
+
+DESCRIPTION_SYSTEM_PROMPT = "You are a helpful assistant for social media content."
+# Static instructions come first and the topic and script last, so every description request
+# shares the same cacheable prompt prefix
+DESCRIPTION_INSTRUCTIONS = (
+    "Write a short, catchy description (1-2 sentences, in colloquial Bahasa Malaysia) for the TikTok script below "
+    "and suggest 3-6 relevant TikTok hashtags (in Bahasa Malaysia and/or English, separated by spaces, no # in description, only in hashtags). "
+    "Format:\nDescription: ...\nHashtags: #tag1 #tag2 #tag3 ..."
+)
+# Routes requests that share a system prompt to the same OpenAI prompt cache; changes with the prompt
+PROMPT_CACHE_KEY_PREFIX = "tiktok-script-"
+SEGMENT_REPAIR_INSTRUCTIONS = (
+    "Some rows of the TikTok script table below need rewriting. Rewrite only the rows listed under 'Rows to rewrite', "
+    "in the same language, tone and columns, so that they flow on from the rows around them. Give each rewritten row "
+    "exactly the Timestamp listed for it and keep its Voiceover within the word limit. Reply with only the rewritten "
+    "rows as markdown table rows, without a header, in the order listed."
+)
+# Rows shown on each side of a row being rewritten
+SEGMENT_CONTEXT_ROWS = 1
+SEGMENT_TOKENS_PER_ROW = 150
+# Rows that still fail after a repair get another go, up to this many repair requests per script
+SEGMENT_REPAIR_ROUNDS = 2
+# Near-duplicate variations in a batch are regenerated at most this many times
+DEDUPE_ROUNDS = 2
+
+
+def build_client(provider, api_key, base_url=None, model_name=None, system_instruction=None):
+    """Creates a provider client.
+
+    Provider SDKs are imported here rather than at module level, so only the selected provider's
+    SDK is ever loaded and importing this module stays cheap. Gemini models are created with their
+    system instruction, which Gemini can cache across requests, instead of prepending it to every prompt.
+    """
+    if provider in ("OpenAI", "OpenRouter"):
+        import openai
+
+        # The client owns a keep-alive connection pool, so reusing it keeps TCP/TLS sessions warm
+        # Retries are handled by the rate limiter (see open_provider_stream) so they count against the limits
+        return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    elif provider == "Gemini":
+        import google.generativeai as genai
+        from google.generativeai import client as genai_client
+
+        with _gemini_configure_lock:
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+            # Bind the gRPC client now so a later configure() for another key can't swap it out
+            model._client = genai_client.get_default_generative_client()
+        return model
+    raise ValueError(f"Unknown API provider: {provider}")
+
+
+def get_client(provider, api_key, base_url=None, model_name=None, system_instruction=None):
+    """Returns a pooled provider client, shared by every caller in the process.
+
+    OpenAI-compatible clients are keyed by provider, API key and base_url and share one connection
+    pool across models. Gemini clients are bound to a model and system instruction, so those are
+    part of their key.
+    """
+    key = (provider, api_key, base_url, model_name, system_instruction)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = build_client(provider, api_key, base_url, model_name, system_instruction)
+        return client
+
+
+def clear_clients():
+    """Drops every pooled client, e.g. after the API key or model changes."""
+    with _clients_lock:
+        _clients.clear()
+
+
+def get_config_client(config, system_instruction=None):
+    """Looks up the shared client for a provider config snapshot.
+
+    system_instruction only matters for Gemini; OpenAI-compatible APIs take it as a system message.
+    """
+    provider = config["api_provider"]
+    if provider != "Gemini":
+        return get_client(provider, config["api_key"], config.get("base_url"))
+    return get_client(provider, config["api_key"], config.get("base_url"), config["model"], system_instruction)
+
+
+def prompt_cache_options(provider, system_prompt):
+    """Extra chat.completions arguments that keep requests sharing system_prompt on the same
+    provider-side prompt cache. Only OpenAI takes a prompt_cache_key; OpenRouter routes on its own.
+
+    The key goes in the request body through extra_body, so older openai SDKs that don't know the
+    prompt_cache_key argument still send it."""
+    if provider != "OpenAI":
+        return {}
+    digest = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+    return {"extra_body": {"prompt_cache_key": PROMPT_CACHE_KEY_PREFIX + digest}}
+
+
+def get_config_limiter(config):
+    """Looks up the shared rate limiter for a provider config snapshot."""
+    return get_limiter(
+        config["api_provider"], config["api_key"],
+        config.get("requests_per_minute", 0), config.get("tokens_per_minute", 0),
+        config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY), config.get("max_retries", DEFAULT_MAX_RETRIES)
+    )
+
+
+def start_call(config, kind):
+    """Returns a CallRecorder for the next provider call. The first call made by a batch task
+    also counts the time the task spent waiting for a worker as queue wait."""
+    queued_since = getattr(_call_context, "queued_since", None)
+    _call_context.queued_since = None
+    return CallRecorder(config["api_provider"], config["model"], kind, queued_since)
+
+
+def response_usage(response):
+    """Returns (prompt_tokens, completion_tokens, cached_prompt_tokens) reported by the provider,
+    or None if it sent none."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        return usage.prompt_tokens, usage.completion_tokens, getattr(details, "cached_tokens", 0) or 0
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None and getattr(metadata, "total_token_count", 0):
+        return (metadata.prompt_token_count, metadata.candidates_token_count,
+                getattr(metadata, "cached_content_token_count", 0) or 0)
+    return None
+
+
+def open_provider_stream(config, request, estimated_tokens=0, kind="script"):
+    """Opens a streamed response with request() through the provider account's rate limiter,
+    retrying throttled and transient failures with backoff (see rate_limit.ProviderLimiter), and
+    returns (stream, call, release), with call recording its metrics under kind. The stream keeps
+    its rate limiter concurrency slot while it is read; the caller calls call.first_token() on the
+    first chunk, and call.finish() and release(throttled) once the stream is closed.
+
+    If the attempt making the request is stopped (see with_failover), the stream is closed and its
+    slot released from the stopping thread, so a hedge that loses stops generating straight away
+    even while it waits for its first chunk. release may be called more than once.
+    """
+    call = start_call(config, kind)
+    limiter = get_config_limiter(config)
+    try:
+        stream = limiter.acquire(request, estimated_tokens, call.on_retry, call.on_start)
+    except Exception:
+        call.finish(error=True)
+        raise
+    released = []
+    release_lock = threading.Lock()
+
+    def release(throttled=False):
+        with release_lock:
+            if released:
+                return
+            released.append(True)
+        limiter.release(throttled)
+
+    def interrupt():
+        # Gemini responses can't be closed; they only give back their slot
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+        release()
+
+    stop = getattr(_call_context, "stop", None)
+    if isinstance(stop, StopEvent):
+        stop.on_set(interrupt)
+    return stream, call, release
+
+
+def chunk_text(chunk):
+    """The text of one streamed chunk from the OpenAI-compatible or Gemini SDK, or ''."""
+    if hasattr(chunk, "choices"):
+        return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+    return chunk.text if chunk.parts else ""
+
+
+def iter_provider_stream(config, request, estimated_tokens=0, kind="script", prompt_tokens=0):
+    """Runs a streamed request (see open_provider_stream) and yields its text chunks.
+
+    However reading ends, including the caller closing the generator early, the response is closed
+    so the provider stops generating tokens nobody reads, and only then is its concurrency slot
+    given back. Once the attempt making the request is stopped (see with_failover), reading stops
+    with BatchCancelled and the call is recorded as stopped rather than failed. prompt_tokens is the
+    estimated prompt size, recorded if the stream ends before the provider reports its usage.
+    """
+    stream, call, release = open_provider_stream(config, request, estimated_tokens, kind)
+    stop = getattr(_call_context, "stop", None)
+    usage = None
+    received = []
+    throttled = False
+    try:
+        for chunk in stream:
+            if stop is not None and stop.is_set():
+                raise BatchCancelled()
+            usage = response_usage(chunk) or usage
+            text = chunk_text(chunk)
+            if text:
+                call.first_token()
+                received.append(text)
+                yield text
+        # A response closed by interrupt may end without an error
+        if stop is not None and stop.is_set():
+            raise BatchCancelled()
+    except BatchCancelled:
+        raise
+    except Exception as e:
+        # A stream closed because its attempt was stopped is not a provider error
+        if stop is not None and stop.is_set():
+            raise BatchCancelled() from e
+        throttled = is_throttle_error(e)
+        call.finish(error=True)
+        raise
+    finally:
+        # Closing the response stops the provider from generating tokens nobody reads
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+        # The concurrency slot is held until the stream is closed, not just opened
+        release(throttled)
+        # Usage only arrives in the last chunk, so streams stopped early are estimated
+        call.set_usage(*(usage or (prompt_tokens, estimate_tokens(*received), 0)))
+        call.finish(stopped=stop is not None and stop.is_set())
+
+
+def read_provider_stream(config, request, estimated_tokens=0, kind="script", prompt_tokens=0):
+    """Runs a streamed request like iter_provider_stream and returns its full text.
+
+    Used for requests whose text is only needed once complete, so that they too stop as soon as
+    the attempt making them is stopped.
+    """
+    return "".join(iter_provider_stream(config, request, estimated_tokens, kind, prompt_tokens))
+
+
+def record_cache_lookup(config, kind, value):
+    """Records a response cache hit or miss and returns value unchanged."""
+    get_metrics().record_cache(config["api_provider"], config["model"], kind, value is not None)
+    return value
+
+
+def estimate_tokens(*texts, output_tokens=0):
+    """Rough token count for the tokens-per-minute budget: about four characters per token."""
+    return sum(len(text) for text in texts) // 4 + output_tokens
+
+
+def script_token_estimate(user_prompt, video_length):
+    """Estimated prompt plus completion tokens for one script request."""
+    output_tokens = STRUCTURED_TOKENS_PER_VARIATION.get(int(video_length), STRUCTURED_TOKENS_PER_VARIATION[60])
+    return estimate_tokens(SYSTEM_PROMPT, user_prompt, output_tokens=output_tokens)
+
+
+def repair_cache_parts(config):
+    """Cache key parts for the timing repairs made before a script is cached (see
+    repair_script_timing): none when repairs are off, so unrepaired scripts keep their keys."""
+    if not config.get("repair_segments"):
+        return []
+    return ["repair", float(config.get("max_words_per_second", DEFAULT_MAX_WORDS_PER_SECOND))]
+
+
+def script_cache_key(config, topic, video_length, avatar=None, variation=None, avoid=None):
+    """Cache key covering everything that determines a script response, including its repairs."""
+    # avoid is only part of the key when set, so existing cached scripts keep their keys
+    return ResponseCache.make_key(
+        "script", config["api_provider"], config["model"], SYSTEM_PROMPT,
+        topic, int(video_length), avatar, variation, *([avoid] if avoid else []), *repair_cache_parts(config)
+    )
+
+
+def description_cache_key(config, script, topic):
+    """Cache key for the description/hashtags of a script."""
+    return ResponseCache.make_key("description", config["api_provider"], config["model"], topic, script)
+
+
+def build_user_prompt(topic, video_length, avatar=None, avoid=None):
+    """Builds the user prompt for a single script request. avoid is the opening of a script this one
+    must not repeat."""
+    user_prompt = f"Create a {video_length}-second TikTok script about {topic}."
+    if avatar:
+        user_prompt += f"\n\nThe script should be tailored for this product/service avatar/persona: {avatar}"
+    if avoid:
+        user_prompt += (
+            f"\n\nUse a different hook, angle and examples from an existing script that opens with: {avoid}"
+        )
+    return user_prompt
+
+
+def request_script(config, topic, video_length, avatar=None, avoid=None):
+    """Requests a script from the configured AI provider. Does not touch Streamlit, so it is safe to run in worker threads; raises on provider errors."""
+    provider = config["api_provider"]
+    model_name = config["model"]
+    user_prompt = build_user_prompt(topic, video_length, avatar, avoid)
+    estimated_tokens = script_token_estimate(user_prompt, video_length)
+
+    prompt_tokens = estimate_tokens(SYSTEM_PROMPT, user_prompt)
+
+    # Read as a stream so a losing hedge can be stopped (see read_provider_stream)
+    if provider == "OpenAI":
+        client = get_config_client(config)
+        return read_provider_stream(config, lambda: client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True},
+            **prompt_cache_options(provider, SYSTEM_PROMPT)
+        ), estimated_tokens, prompt_tokens=prompt_tokens)
+
+    elif provider == "OpenRouter":
+        client = get_config_client(config)
+        return read_provider_stream(config, lambda: client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_headers=OPENROUTER_HEADERS
+        ), estimated_tokens, prompt_tokens=prompt_tokens)
+
+    elif provider == "Gemini":
+        model = get_config_client(config, SYSTEM_PROMPT)
+        return read_provider_stream(
+            config, lambda: model.generate_content(user_prompt, stream=True), estimated_tokens,
+            prompt_tokens=prompt_tokens
+        )
+
+    raise ValueError(f"Unknown API provider: {provider}")
+
+
+def iter_script_chunks(config, topic, video_length, avatar=None, avoid=None):
+    """Yields script text chunks from the provider's streaming API. Safe to run in worker threads."""
+    provider = config["api_provider"]
+    model_name = config["model"]
+    user_prompt = build_user_prompt(topic, video_length, avatar, avoid)
+
+    estimated_tokens = script_token_estimate(user_prompt, video_length)
+    prompt_tokens = estimate_tokens(SYSTEM_PROMPT, user_prompt)
+
+    # Only opening the stream is rate limited and retried; a failure mid-stream is not replayed
+    if provider in ("OpenAI", "OpenRouter"):
+        client = get_config_client(config)
+        yield from iter_provider_stream(config, lambda: client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_headers=OPENROUTER_HEADERS if provider == "OpenRouter" else None,
+            **prompt_cache_options(provider, SYSTEM_PROMPT)
+        ), estimated_tokens, prompt_tokens=prompt_tokens)
+
+    elif provider == "Gemini":
+        model = get_config_client(config, SYSTEM_PROMPT)
+        yield from iter_provider_stream(
+            config, lambda: model.generate_content(user_prompt, stream=True), estimated_tokens,
+            prompt_tokens=prompt_tokens
+        )
+
+    else:
+        raise ValueError(f"Unknown API provider: {provider}")
+
+
+def stream_script(config, topic, video_length, avatar=None, on_update=None, avoid=None):
+    """Streams a script from the provider and returns the full text.
+
+    on_update(text) is called with the text received so far every time a table row completes.
+    Reading stops as soon as the row whose Timestamp reaches video_length arrives, so trailing
+    notes are never generated.
+    """
+    complete_lines = []
+    partial_line = ""
+    chunks = iter_script_chunks(config, topic, video_length, avatar, avoid)
+    try:
+        for chunk in chunks:
+            lines = (partial_line + chunk).split('\n')
+            partial_line = lines.pop()
+            row_completed = False
+            for line in lines:
+                complete_lines.append(line)
+                cells = split_table_row(line)
+                if cells is None:
+                    continue
+                row_completed = True
+                segment = parse_timestamp_range(cells[0])
+                if segment and segment[1] >= int(video_length):
+                    script = '\n'.join(complete_lines)
+                    if on_update:
+                        on_update(script)
+                    return script
+            if row_completed and on_update:
+                on_update('\n'.join(complete_lines))
+    finally:
+        chunks.close()
+    complete_lines.append(partial_line)
+    return '\n'.join(complete_lines)
+
+
+def request_description_and_hashtags(config, script, topic):
+    """Requests a short description and hashtags for a script. Safe to run in worker threads; raises on provider errors."""
+    provider = config["api_provider"]
+    model_name = config["model"]
+    prompt = f"{DESCRIPTION_INSTRUCTIONS}\n\nTopic: {topic}\n\nScript:\n{script}"
+    estimated_tokens = estimate_tokens(DESCRIPTION_SYSTEM_PROMPT, prompt, output_tokens=DESCRIPTION_MAX_TOKENS)
+    prompt_tokens = estimate_tokens(DESCRIPTION_SYSTEM_PROMPT, prompt)
+    if provider == "OpenAI":
+        client = get_config_client(config)
+        return read_provider_stream(config, lambda: client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": DESCRIPTION_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=DESCRIPTION_MAX_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True},
+            **prompt_cache_options(provider, DESCRIPTION_SYSTEM_PROMPT)
+        ), estimated_tokens, "description", prompt_tokens).strip()
+    elif provider == "OpenRouter":
+        client = get_config_client(config)
+        return read_provider_stream(config, lambda: client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": DESCRIPTION_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=DESCRIPTION_MAX_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_headers=OPENROUTER_HEADERS
+        ), estimated_tokens, "description", prompt_tokens).strip()
+    elif provider == "Gemini":
+        model = get_config_client(config, DESCRIPTION_SYSTEM_PROMPT)
+        return read_provider_stream(
+            config, lambda: model.generate_content(prompt, stream=True), estimated_tokens, "description", prompt_tokens
+        ).strip()
+
+    raise ValueError(f"Unknown API provider: {provider}")
+
+
+def build_structured_prompt(topic, video_length, avatar, n_variations):
+    """Builds the user prompt asking for several variations as one JSON object.
+
+    The instructions come before the topic so requests share as long a cacheable prefix as possible.
+    """
+    user_prompt = build_user_prompt(topic, video_length, avatar)
+    return (
+        f"Write {n_variations} clearly different variations of the script requested below (different hooks, angles and calls to action). "
+        "For each variation also write a short, catchy description (1-2 sentences, in colloquial Bahasa Malaysia) "
+        "and 3-6 relevant TikTok hashtags (in Bahasa Malaysia and/or English).\n\n"
+        "Respond with JSON only, in this shape:\n"
+        '{"variations": [{"script": "<the full markdown table>", "description": "<description, no hashtags>", "hashtags": "#tag1 #tag2 #tag3"}]}'
+        f"\n\n{user_prompt}"
+    )
+
+
+def structured_chunk_size(video_length):
+    """How many variations fit into one structured request's output token budget."""
+    per_variation = STRUCTURED_TOKENS_PER_VARIATION.get(int(video_length), STRUCTURED_TOKENS_PER_VARIATION[60])
+    return max(1, STRUCTURED_MAX_OUTPUT_TOKENS // per_variation)
+
+
+def request_structured_variations(config, topic, video_length, avatar, n_variations):
+    """Requests n_variations scripts with descriptions in a single call and returns the raw response text.
+
+    Uses JSON mode (OpenAI/OpenRouter response_format, Gemini response_mime_type) and retries once
+    without it for models that reject it. Safe to run in worker threads; raises on provider errors.
+    """
+    provider = config["api_provider"]
+    model_name = config["model"]
+    user_prompt = build_structured_prompt(topic, video_length, avatar, n_variations)
+    estimated_tokens = estimate_tokens(SYSTEM_PROMPT, user_prompt, output_tokens=STRUCTURED_MAX_OUTPUT_TOKENS)
+    prompt_tokens = estimate_tokens(SYSTEM_PROMPT, user_prompt)
+
+    if provider in ("OpenAI", "OpenRouter"):
+        # Already imported by get_config_client
+        import openai
+
+        client = get_config_client(config)
+        request = dict(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.9,
+            max_tokens=STRUCTURED_MAX_OUTPUT_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_headers=OPENROUTER_HEADERS if provider == "OpenRouter" else None,
+            **prompt_cache_options(provider, SYSTEM_PROMPT)
+        )
+        try:
+            return read_provider_stream(
+                config, lambda: client.chat.completions.create(response_format={"type": "json_object"}, **request),
+                estimated_tokens, "structured", prompt_tokens
+            )
+        except openai.BadRequestError:
+            return read_provider_stream(
+                config, lambda: client.chat.completions.create(**request), estimated_tokens, "structured",
+                prompt_tokens
+            )
+
+    elif provider == "Gemini":
+        model = get_config_client(config, SYSTEM_PROMPT)
+        generation_config = {"max_output_tokens": STRUCTURED_MAX_OUTPUT_TOKENS, "temperature": 0.9}
+        try:
+            return read_provider_stream(config, lambda: model.generate_content(
+                user_prompt,
+                generation_config={**generation_config, "response_mime_type": "application/json"},
+                stream=True
+            ), estimated_tokens, "structured", prompt_tokens)
+        except BatchCancelled:
+            raise
+        except Exception as e:
+            if is_retryable_error(e):
+                raise
+            return read_provider_stream(
+                config, lambda: model.generate_content(user_prompt, generation_config=generation_config, stream=True),
+                estimated_tokens, "structured", prompt_tokens
+            )
+
+    raise ValueError(f"Unknown API provider: {provider}")
+
+
+def build_segment_repair_prompt(topic, video_length, script, windows, issues):
+    """Builds the user prompt asking for replacements of the rows in windows
+    ({row_index: ((start, end), max_words)}), showing the neighbouring rows as context and the
+    problems with each row."""
+    table = parse_script_table(script)
+    timestamps = table.column('Timestamp')
+    context = sorted({
+        neighbour for row in windows
+        for neighbour in range(row - SEGMENT_CONTEXT_ROWS, row + SEGMENT_CONTEXT_ROWS + 1)
+        if 0 <= neighbour < len(table)
+    })
+    lines = [format_table_row(table.headers), format_table_row(["---"] * len(table.headers))]
+    lines += [format_table_row(table.rows[idx]) for idx in context]
+    problems = {}
+    for row, problem in issues:
+        problems.setdefault(row, []).append(problem)
+    targets = [
+        f"- Row {row + 1} (currently {timestamps[row]}): Timestamp {format_timestamp_range(*window)}, "
+        f"at most {words} words. Problem: {' '.join(problems.get(row, []))}"
+        for row, (window, words) in sorted(windows.items())
+    ]
+    return (
+        f"{SEGMENT_REPAIR_INSTRUCTIONS}\n\nTopic: {topic}\nVideo length: {video_length} seconds\n\n"
+        "Rows around the ones to rewrite:\n" + '\n'.join(lines) + "\n\nRows to rewrite:\n" + '\n'.join(targets)
+    )
+
+
+def request_segment_rows(config, user_prompt, n_rows):
+    """Requests rewritten table rows for a segment repair prompt and returns the raw response text.
+    Safe to run in worker threads; raises on provider errors."""
+    provider = config["api_provider"]
+    model_name = config["model"]
+    max_tokens = n_rows * SEGMENT_TOKENS_PER_ROW
+    estimated_tokens = estimate_tokens(SYSTEM_PROMPT, user_prompt, output_tokens=max_tokens)
+    prompt_tokens = estimate_tokens(SYSTEM_PROMPT, user_prompt)
+
+    if provider in ("OpenAI", "OpenRouter"):
+        client = get_config_client(config)
+        return read_provider_stream(config, lambda: client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_headers=OPENROUTER_HEADERS if provider == "OpenRouter" else None,
+            **prompt_cache_options(provider, SYSTEM_PROMPT)
+        ), estimated_tokens, "segments", prompt_tokens)
+
+    elif provider == "Gemini":
+        model = get_config_client(config, SYSTEM_PROMPT)
+        return read_provider_stream(config, lambda: model.generate_content(
+            user_prompt, generation_config={"max_output_tokens": max_tokens, "temperature": 0.7}, stream=True
+        ), estimated_tokens, "segments", prompt_tokens)
+
+    raise ValueError(f"Unknown API provider: {provider}")
+
+
+def repair_script_timing(config, topic, video_length, script, cancel_event=None):
+    """Checks a script's timing (see script_table.validate_script_timing) and regenerates only the
+    rows that fail, with their neighbours as context, splicing the new rows into the script.
+
+    Rewritten rows get the Timestamps planned by plan_segment_windows, so the segments run back to
+    back; rows that start after the video ends are dropped without a request. Rewritten rows are
+    matched to their rows by those Timestamps. A round whose reply misses a row, or that does not
+    reduce the problems, is discarded. Never raises: returns (script, remaining problems), with the
+    script as it was if a repair request fails.
+    """
+    max_words_per_second = config.get("max_words_per_second", DEFAULT_MAX_WORDS_PER_SECOND)
+    issues = validate_script_timing(script, video_length, max_words_per_second)
+    for _ in range(SEGMENT_REPAIR_ROUNDS):
+        if not issues or any(row is None for row, _ in issues) or is_cancelled(cancel_event):
+            break
+        windows = plan_segment_windows(script, video_length, {row for row, _ in issues})
+        replacements = {row: None for row, window in windows.items() if window is None}
+        targets = {
+            row: (window, int((window[1] - window[0]) * max_words_per_second))
+            for row, window in windows.items() if window is not None
+        }
+        if targets:
+            prompt = build_segment_repair_prompt(topic, video_length, script, targets, issues)
+            try:
+                text = with_failover(
+                    config, "segments", lambda attempt_config, stop: request_segment_rows(attempt_config, prompt, len(targets)),
+                    cancel_event=cancel_event
+                )
+            except Exception:
+                break
+            headers = parse_script_table(script).headers
+            new_rows = [
+                cells for cells in (split_table_row(line) for line in text.split('\n'))
+                if cells is not None and tuple(cells) != headers
+            ]
+            timestamp_index = headers.index('Timestamp')
+            # Replies are matched to their rows by the Timestamp each row was given, so echoed context
+            # rows and rows in another order can't land on the wrong row
+            rows_by_window = {window: row for row, (window, _) in targets.items()}
+            for cells in new_rows:
+                window = parse_timestamp_range(cells[timestamp_index]) if len(cells) > timestamp_index else None
+                row = rows_by_window.pop(window, None)
+                if row is None:
+                    continue
+                # Same shape as parse_script_table rows
+                if len(cells) < len(headers):
+                    cells += [''] * (len(headers) - len(cells))
+                elif len(cells) > len(headers):
+                    cells[len(headers) - 1:] = [' | '.join(cells[len(headers) - 1:])]
+                cells[timestamp_index] = format_timestamp_range(*window)
+                replacements[row] = cells
+            if rows_by_window:
+                # A row left out would keep its old Timestamp next to rewritten ones
+                break
+        repaired = replace_table_rows(script, replacements)
+        remaining = validate_script_timing(repaired, video_length, max_words_per_second)
+        if len(remaining) >= len(issues):
+            break
+        script, issues = repaired, remaining
+    return script, issues
+
+
+def split_markdown_variations(text):
+    """Fallback for non-JSON replies: one variation per markdown table, with any Description/Hashtags lines that follow it."""
+    variations = []
+    table_lines = []
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('|') and stripped.endswith('|'):
+            table_lines.append(stripped)
+            continue
+        if table_lines:
+            variations.append({'script': '\n'.join(table_lines), 'description': ''})
+            table_lines = []
+        lowered = stripped.lower().lstrip('*')
+        if variations and (lowered.startswith('description') or lowered.startswith('hashtags')):
+            variations[-1]['description'] = (variations[-1]['description'] + '\n' + stripped).strip()
+    if table_lines:
+        variations.append({'script': '\n'.join(table_lines), 'description': ''})
+    return variations
+
+
+def parse_structured_variations(text):
+    """Parses a multi-variation reply into [{'script': ..., 'description': ...}].
+
+    Accepts the requested JSON shape (optionally wrapped in a code fence or surrounded by prose),
+    or a single variation object, and falls back to splitting plain markdown tables.
+    """
+    data = None
+    # Take the outermost object/array so code fences and surrounding prose are ignored
+    for start, end in (('{', '}'), ('[', ']')):
+        first, last = text.find(start), text.rfind(end)
+        if first == -1 or last <= first:
+            continue
+        try:
+            data = json.loads(text[first:last + 1])
+            break
+        except ValueError:
+            continue
+    if isinstance(data, dict):
+        if isinstance(data.get('variations', data.get('scripts')), list):
+            data = data.get('variations', data.get('scripts'))
+        elif 'script' in data or 'table' in data:
+            # One-variation requests are often answered with the bare variation object
+            data = [data]
+        else:
+            data = None
+    if not isinstance(data, list):
+        return split_markdown_variations(text)
+
+    variations = []
+    for item in data:
+        if isinstance(item, str):
+            item = {'script': item}
+        if not isinstance(item, dict):
+            continue
+        script = str(item.get('script') or item.get('table') or '').strip()
+        description = str(item.get('description') or '').strip()
+        hashtags = item.get('hashtags') or ''
+        if isinstance(hashtags, list):
+            hashtags = ' '.join(hashtags)
+        parts = []
+        if description:
+            parts.append(description if description.lower().startswith('description') else f"Description: {description}")
+        if hashtags:
+            parts.append(hashtags if hashtags.lower().startswith('hashtags') else f"Hashtags: {hashtags}")
+        variations.append({'script': script, 'description': '\n'.join(parts)})
+    return variations
+
+
+def is_valid_script(script):
+    """True if the script contains a markdown table with a header and at least one data row."""
+    return len(parse_script_table(script)) >= 1
+
+
+def has_valid_variation(text):
+    """True if a structured reply contains at least one valid script."""
+    return any(is_valid_script(variation['script']) for variation in parse_structured_variations(text))
+
+
+class BatchCancelled(Exception):
+    """Raised from a streaming update to stop a variation whose batch was cancelled, or a hedged
+    attempt that lost the race."""
+
+
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def with_failover(config, kind, attempt, is_valid=None, cancel_event=None):
+    """Runs attempt(attempt_config, stop_event) for config, failing over to config["fallbacks"] in order
+    and, when config["hedging"] is set, hedging slow attempts (see hedging.race).
+
+    A request is hedged once it has run longer than the hedging quantile of its provider's recent
+    latencies for kind, or the configured delay until enough calls have been seen. Hedges,
+    failovers and wins are recorded in the metrics. Setting cancel_event raises RaceCancelled
+    straight away. Without fallbacks, attempt runs on the calling thread with cancel_event as its
+    stop event. Provider requests made by an attempt stop when its stop event is set (see
+    read_provider_stream), so losing hedges and cancelled requests stop generating.
+    """
+    fallbacks = config.get("fallbacks") or []
+    hedging = config.get("hedging")
+    queued_since = getattr(_call_context, "queued_since", None)
+    _call_context.queued_since = None
+
+    def hedge_delay(attempt_config):
+        observed = get_metrics().latency_quantile(
+            attempt_config["api_provider"], attempt_config["model"], kind, hedging["quantile"], hedging["min_samples"]
+        )
+        return hedging["delay_seconds"] if observed is None else observed
+
+    def run_attempt(attempt_config, stop):
+        previous_stop = getattr(_call_context, "stop", None)
+        _call_context.stop = stop
+        if attempt_config is config:
+            # Attempts run on their own threads; the primary still counts the batch queue wait
+            _call_context.queued_since = queued_since
+        try:
+            return attempt(attempt_config, stop)
+        finally:
+            _call_context.queued_since = None
+            _call_context.stop = previous_stop
+
+    if not fallbacks:
+        return run_attempt(config, cancel_event if cancel_event is not None else threading.Event())
+
+    def on_event(event, event_config):
+        get_metrics().record_hedge(event_config["api_provider"], event_config["model"], kind, event)
+
+    return race([config] + fallbacks, run_attempt, hedge_delay if hedging else None, is_valid, cancel_event, on_event)
+
+
+def generate_variation_chunk(config, topic, video_length, avatar, n_variations, chunk_index=0, cache=None,
+                             cancel_event=None):
+    """Generates n_variations scripts and descriptions with one structured request.
+
+    Never raises: returns one (script, desc_tag, error) tuple per requested variation, like generate_variation.
+    """
+    if is_cancelled(cancel_event):
+        return [(None, "", CANCELLED_ERROR)] * n_variations
+    try:
+        text = None
+        if cache:
+            key = ResponseCache.make_key(
+                "structured", config["api_provider"], config["model"], SYSTEM_PROMPT,
+                topic, int(video_length), avatar, chunk_index, n_variations, *repair_cache_parts(config)
+            )
+            text = record_cache_lookup(config, "structured", cache.get(key))
+        fresh = text is None
+        if fresh:
+            text = with_failover(
+                config, "structured",
+                lambda attempt_config, stop: request_structured_variations(
+                    attempt_config, topic, video_length, avatar, n_variations
+                ),
+                has_valid_variation, cancel_event
+            )
+        variations = parse_structured_variations(text)
+    except (BatchCancelled, RaceCancelled):
+        return [(None, "", CANCELLED_ERROR)] * n_variations
+    except Exception as e:
+        return [(None, "", f"An error occurred: {e}")] * n_variations
+
+    results = []
+    for i in range(n_variations):
+        if i >= len(variations):
+            results.append((None, "", "The response contained fewer variations than requested."))
+        elif not is_valid_script(variations[i]['script']):
+            results.append((None, "", "The response did not contain a valid script table."))
+        else:
+            if fresh and config.get("repair_segments"):
+                variations[i]['script'], _ = repair_script_timing(
+                    config, topic, video_length, variations[i]['script'], cancel_event
+                )
+            results.append((variations[i]['script'], variations[i]['description'], None))
+    if cache and fresh and any(script for script, _, _ in results):
+        # Cached in the requested JSON shape, with any repaired rows
+        cache.set(key, json.dumps({"variations": variations}, ensure_ascii=False))
+    return results
+
+
+def generate_variation(config, topic, video_length, avatar=None, on_update=None, variation=None, cache=None,
+                       cancel_event=None, avoid=None):
+    """Generates one script and, as soon as it arrives, its description and hashtags.
+
+    Streams the script when on_update is given (see stream_script). With config["repair_segments"],
+    rows with timing problems are regenerated (see repair_script_timing) before the script is
+    cached. When a ResponseCache is given,
+    cached responses are returned without calling the provider and new ones are stored. Requests
+    fail over to the config's fallback providers, and are hedged if enabled (see with_failover);
+    while several attempts stream, on_update follows the first one to send a row. Once
+    cancel_event is set, the variation stops before its next request or streamed row. avoid is
+    passed on to build_user_prompt.
+    Never raises: returns (script, desc_tag, error) so one failed variation cannot abort the batch.
+    """
+    if is_cancelled(cancel_event):
+        return None, "", CANCELLED_ERROR
+    # The stop event of the attempt whose rows are passed to on_update
+    leader = []
+    leader_lock = threading.Lock()
+
+    def attempt_script(attempt_config, stop):
+        if stop.is_set():
+            raise BatchCancelled()
+        if not on_update:
+            return request_script(attempt_config, topic, video_length, avatar, avoid)
+
+        def report(text):
+            if stop.is_set():
+                raise BatchCancelled()
+            with leader_lock:
+                if not leader:
+                    leader.append(stop)
+                if leader[0] is not stop:
+                    return
+            on_update(text)
+
+        try:
+            return stream_script(attempt_config, topic, video_length, avatar, report, avoid)
+        except Exception:
+            with leader_lock:
+                # Let another attempt's rows take over
+                if leader and leader[0] is stop:
+                    leader.clear()
+            raise
+
+    try:
+        script = None
+        if cache:
+            script_key = script_cache_key(config, topic, video_length, avatar, variation, avoid)
+            script = record_cache_lookup(config, "script", cache.get(script_key))
+        if script is not None:
+            if on_update:
+                on_update(script)
+        else:
+            script = with_failover(config, "script", attempt_script, is_valid_script, cancel_event)
+            shown = script
+            if script and config.get("repair_segments"):
+                script, _ = repair_script_timing(config, topic, video_length, script, cancel_event)
+            if on_update and script and (script != shown or config.get("fallbacks")):
+                # The winning attempt may not be the one that was shown, and repairs change rows
+                on_update(script)
+            if cache and script:
+                cache.set(script_key, script)
+    except (BatchCancelled, RaceCancelled):
+        return None, "", CANCELLED_ERROR
+    except Exception as e:
+        return None, "", f"An error occurred: {e}"
+    if is_cancelled(cancel_event):
+        return script, "", CANCELLED_ERROR
+    try:
+        desc_tag = None
+        if cache:
+            desc_key = description_cache_key(config, script, topic)
+            desc_tag = record_cache_lookup(config, "description", cache.get(desc_key))
+        if desc_tag is None:
+            desc_tag = with_failover(
+                config, "description",
+                lambda attempt_config, stop: request_description_and_hashtags(attempt_config, script, topic)
+            )
+            if cache and desc_tag:
+                cache.set(desc_key, desc_tag)
+    except Exception as e:
+        return script, "", f"Error generating description/hashtags: {e}"
+    return script, desc_tag, None
+
+
+def run_queued(submitted_at, fn, *args):
+    """Runs fn(*args) on a worker, noting when it was submitted so the first provider call it makes
+    counts the time spent waiting for a free worker as queue wait."""
+    _call_context.queued_since = submitted_at
+    try:
+        return fn(*args)
+    finally:
+        _call_context.queued_since = None
+
+
+def variation_avatars(avatar, n_variations):
+    """Returns the avatar for each variation, with a variation hint for more diversity."""
+    if not avatar:
+        return [avatar] * n_variations
+    return [f"{avatar} (Variation {i+1})" for i in range(n_variations)]
+
+
+def submit_batch(executor, config, topic, video_length, avatar=None, n_variations=7, cache=None, batch_mode="Per variation",
+                 on_update=None, on_done=None, cancel_event=None):
+    """Submits the requests for one batch of variations to executor and returns their futures.
+
+    on_update(variation_index, partial_script), if given, is called from worker threads as scripts
+    stream in (or, in "Single request" mode, as each chunk completes), and on_done(variation_index,
+    result) once each variation's (script, desc_tag, error) is final. Setting cancel_event stops the
+    batch early; unfinished variations end with CANCELLED_ERROR. Pass the futures to collect_batch.
+    """
+    futures = []
+    if batch_mode == "Single request":
+
+        def report_chunk(start, chunk_results):
+            for offset, result in enumerate(chunk_results):
+                if on_update and result[0]:
+                    on_update(start + offset, result[0])
+                if on_done:
+                    on_done(start + offset, result)
+
+        # One request per chunk of variations, each chunk sized to the output token budget
+        chunk_size = structured_chunk_size(video_length)
+        for chunk_index, start in enumerate(range(0, n_variations, chunk_size)):
+            future = executor.submit(
+                run_queued, time.monotonic(), generate_variation_chunk, config, topic, video_length, avatar,
+                min(chunk_size, n_variations - start), chunk_index, cache, cancel_event
+            )
+            if on_update or on_done:
+                future.add_done_callback(lambda f, start=start: report_chunk(start, f.result()))
+            futures.append(future)
+    else:
+        for i, variation_avatar in enumerate(variation_avatars(avatar, n_variations)):
+            variation_update = None
+            if on_update:
+                variation_update = lambda text, idx=i: on_update(idx, text)
+            future = executor.submit(
+                run_queued, time.monotonic(), generate_variation, config, topic, video_length,
+                variation_avatar, variation_update, i, cache, cancel_event
+            )
+            if on_done:
+                future.add_done_callback(lambda f, idx=i: on_done(idx, f.result()))
+            futures.append(future)
+    return futures
+
+
+def script_opening(script):
+    """The first voiceover line of a script (or its first line without a table), to name it in a prompt."""
+    voiceover = parse_script_table(script).column('Voiceover')
+    opening = voiceover[0] if voiceover else script.strip().split('\n')[0]
+    return opening.strip().strip('"')[:200]
+
+
+def regenerate_duplicates(executor, config, topic, video_length, avatar, results, cache=None, on_update=None,
+                          on_done=None, cancel_event=None):
+    """Regenerates the variations in results that are near-duplicates of an earlier one and returns
+    the updated results.
+
+    Duplicates are found with similarity.find_duplicates at config["duplicate_similarity"], and only
+    they are requested again, on executor, as new variations told to avoid the opening of the script
+    they repeat. This repeats up to DEDUPE_ROUNDS times while duplicates remain. A regenerated
+    script only replaces the duplicate if it arrives without errors. on_update and on_done are
+    called as in submit_batch, on_done again with each duplicate's final result.
+    """
+    results = list(results)
+    n_variations = len(results)
+    avatars = variation_avatars(avatar, n_variations)
+    threshold = config.get("duplicate_similarity", DUPLICATE_SIMILARITY)
+    for dedupe_round in range(1, DEDUPE_ROUNDS + 1):
+        if is_cancelled(cancel_event):
+            break
+        duplicates = find_duplicates([script for script, _, _ in results], threshold)
+        if not duplicates:
+            break
+        futures = {}
+        for idx, original in duplicates.items():
+            variation_update = None
+            if on_update:
+                variation_update = lambda text, idx=idx: on_update(idx, text)
+            futures[idx] = executor.submit(
+                run_queued, time.monotonic(), generate_variation, config, topic, video_length, avatars[idx],
+                variation_update, dedupe_round * n_variations + idx, cache, cancel_event,
+                script_opening(results[original][0])
+            )
+        for idx, future in futures.items():
+            script, desc_tag, error = future.result()
+            if script and error is None:
+                results[idx] = (script, desc_tag, None)
+            if on_done:
+                on_done(idx, results[idx])
+    return results
+
+
+def collect_batch(futures):
+    """Returns one (script, desc_tag, error) tuple per variation, in variation order."""
+    results = []
+    for future in futures:
+        result = future.result()
+        # Single-request chunks return a list of variations
+        results.extend(result if isinstance(result, list) else [result])
+    return results
+
+
+def run_batch(config, topic, video_length, avatar=None, n_variations=7, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+              cache=None, batch_mode="Per variation", on_update=None, poll=None, on_done=None, cancel_event=None):
+    """Generates a batch of variations concurrently, at most max_concurrency requests in flight.
+
+    Each variation's description starts as soon as its script arrives, and one failed variation does
+    not abort the rest. With config["dedupe_variations"], near-duplicate variations are then
+    regenerated (see regenerate_duplicates). poll(), if given, is called on the calling thread about
+    ten times a second while the batch runs. See submit_batch for on_update, on_done and
+    cancel_event. Returns the collect_batch results.
+    """
+    max_workers = max(1, min(int(max_concurrency), n_variations))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = submit_batch(
+            executor, config, topic, video_length, avatar, n_variations, cache, batch_mode,
+            on_update, on_done, cancel_event
+        )
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.1 if poll else None)
+            if poll:
+                poll()
+        results = collect_batch(futures)
+        if config.get("dedupe_variations"):
+            results = regenerate_duplicates(
+                executor, config, topic, video_length, avatar, results, cache, on_update, on_done, cancel_event
+            )
+        return results
@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+# Hedges never fire sooner than this, however fast the observed latencies are
+MIN_HEDGE_DELAY_SECONDS = 0.5
+# How often a race checks its cancel event while attempts are running
+CANCEL_POLL_SECONDS = 0.1
+
+REQUEST = "request"
+HEDGE = "hedge"
+FAILOVER = "failover"
+WIN = "win"
+
+
+class RaceCancelled(Exception):
+    """Raised by race when its cancel_event is set before an attempt wins."""
+
+
+class StopEvent(threading.Event):
+    """An Event that also runs the callbacks registered with on_set when it is set, so the thread
+    that stops an attempt can interrupt a request the attempt is blocked on."""
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def on_set(self, callback):
+        """Calls callback() when the event is set, or straight away if it already is."""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # Interrupting is best effort; the attempt still sees the event on its next check
+                pass
+
+
+def race(configs, attempt, hedge_delay=None, is_valid=None, cancel_event=None, on_event=None):
+    """Runs attempt(config, stop_event) for configs[0], falling back on the later configs in order.
+
+    A backup attempt for the next config starts when the newest attempt fails or returns an invalid
+    result (failover), or when it has been running for hedge_delay(config) seconds (hedge; a delay of
+    None never hedges). Attempts run on their own threads and the first result that is_valid
+    accepts wins: the other attempts have their stop_event (a StopEvent) set and their results are
+    discarded. Attempts should check stop_event between steps (e.g. streamed chunks) and can
+    register StopEvent.on_set callbacks to interrupt blocking requests.
+
+    Once cancel_event is set, every attempt is told to stop and RaceCancelled is raised without
+    waiting for them. on_event(event, config), if given, is called with REQUEST and
+    configs[0] when the race starts, with HEDGE or FAILOVER and the config being backed up for each
+    backup started, and with WIN and the config whose result was used when more than one attempt
+    ran. If every attempt fails, the first invalid result is returned if there was one, otherwise
+    the last error is raised.
+    """
+    outcomes = queue.Queue()
+    stops = []
+
+    def run(config, stop):
+        try:
+            outcomes.put((config, attempt(config, stop), None))
+        except Exception as e:
+            outcomes.put((config, None, e))
+
+    def launch(reason):
+        if on_event:
+            # Hedges and failovers count against the attempt being backed up
+            on_event(reason, configs[max(0, len(stops) - 1)])
+        config = configs[len(stops)]
+        stops.append(StopEvent())
+        threading.Thread(target=run, args=(config, stops[-1]), daemon=True, name="hedge-attempt").start()
+
+    def stop_all():
+        for stop in stops:
+            stop.set()
+
+    def next_hedge_at():
+        """When to hedge the newest attempt, or None if there is nothing left to hedge with."""
+        if not hedge_delay or len(stops) >= len(configs):
+            return None
+        delay = hedge_delay(configs[len(stops) - 1])
+        return None if delay is None else time.monotonic() + max(MIN_HEDGE_DELAY_SECONDS, delay)
+
+    launch(REQUEST)
+    hedge_at = next_hedge_at()
+    running = 1
+    invalid_result = None
+    last_error = None
+    while True:
+        timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+        if cancel_event is not None:
+            timeout = CANCEL_POLL_SECONDS if timeout is None else min(timeout, CANCEL_POLL_SECONDS)
+        try:
+            config, result, error = outcomes.get(timeout=timeout)
+        except queue.Empty:
+            config = None
+        if cancel_event is not None and cancel_event.is_set():
+            stop_all()
+            raise RaceCancelled()
+        if config is None:
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                launch(HEDGE)
+                hedge_at = next_hedge_at()
+                running += 1
+            continue
+        running -= 1
+        if error is None and (is_valid is None or is_valid(result)):
+            stop_all()
+            if on_event and len(stops) > 1:
+                on_event(WIN, config)
+            return result
+        if error is None:
+            invalid_result = result if invalid_result is None else invalid_result
+        else:
+            last_error = error
+        if len(stops) < len(configs):
+            launch(FAILOVER)
+            hedge_at = next_hedge_at()
+            running += 1
+            continue
+        if running == 0:
+            if invalid_result is not None:
+                return invalid_result
+            raise last_error
@@ -0,0 +1,268 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+from similarity import (DUPLICATE_SIMILARITY, band_keys, decode_signature, encode_signature, script_signature,
+                        signature_similarity, term_similarity, topic_terms)
+
+HISTORY_COLUMNS = ("id", "timestamp", "topic", "video_length", "avatar", "script", "description", "provider", "model")
+
+
+class HistoryStore:
+    """Persistent script history backed by SQLite.
+
+    Indexed on timestamp, topic, provider/model and video_length so filtering, paging and
+    deleting stay cheap as history grows. Items are plain dicts with the same keys as the
+    in-memory history used to have, plus id, provider and model.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, topic TEXT NOT NULL, "
+                "video_length INTEGER NOT NULL, avatar TEXT, script TEXT NOT NULL, description TEXT, "
+                "provider TEXT, model TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_topic ON history (topic COLLATE NOCASE)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_provider_model ON history (provider, model)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_video_length ON history (video_length)")
+            # Similarity index: each script's MinHash signature, its LSH band keys and its topic's terms
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS script_signatures (item_id INTEGER PRIMARY KEY, signature BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS script_bands (band_key INTEGER NOT NULL, item_id INTEGER NOT NULL, "
+                "PRIMARY KEY (band_key, item_id)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS topic_terms (term TEXT NOT NULL, item_id INTEGER NOT NULL, "
+                "PRIMARY KEY (term, item_id)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_script_bands_item ON script_bands (item_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_topic_terms_item ON topic_terms (item_id)")
+        # Scripts stored before the similarity index existed are indexed on the first lookup
+        self._backfilled = False
+
+    def add(self, topic, video_length, script, avatar=None, timestamp=None, description=None, provider=None, model=None):
+        """Stores a script, adds it to the similarity index and returns its id."""
+        if timestamp is None:
+            timestamp = datetime.now()
+        # Hashing is the slow part of indexing, so it happens before the lock is taken
+        signature = script_signature(script)
+        terms = topic_terms(topic)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO history (timestamp, topic, video_length, avatar, script, description, provider, model) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (timestamp.isoformat(sep=' '), topic, int(video_length), avatar, script, description, provider, model)
+            )
+            self._index([(cursor.lastrowid, signature, terms)])
+            return cursor.lastrowid
+
+    def _index(self, entries):
+        """Writes the similarity index rows for (item_id, signature, terms) entries; the caller holds
+        the lock and the transaction."""
+        signed = [(item_id, signature) for item_id, signature, _ in entries if signature is not None]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO script_signatures (item_id, signature) VALUES (?, ?)",
+            [(item_id, encode_signature(signature)) for item_id, signature in signed]
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO script_bands (band_key, item_id) VALUES (?, ?)",
+            [(key, item_id) for item_id, signature in signed for key in band_keys(signature)]
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO topic_terms (term, item_id) VALUES (?, ?)",
+            [(term, item_id) for item_id, _, terms in entries for term in terms]
+        )
+
+    def _backfill_index(self, batch_size=500):
+        """Indexes scripts stored before the similarity index existed, batch_size at a time."""
+        if self._backfilled:
+            return
+        last_id = 0
+        while True:
+            # A script counts as indexed once it has a signature or topic terms
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, topic, script FROM history h WHERE id > ? "
+                    "AND NOT EXISTS (SELECT 1 FROM script_signatures WHERE item_id = h.id) "
+                    "AND NOT EXISTS (SELECT 1 FROM topic_terms WHERE item_id = h.id) ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                break
+            indexed = [(item_id, script_signature(script), topic_terms(topic)) for item_id, topic, script in rows]
+            with self._lock, self._conn:
+                self._index(indexed)
+            last_id = rows[-1][0]
+        self._backfilled = True
+
+    @staticmethod
+    def _where(topic=None, video_lengths=None, provider=None, model=None):
+        """Builds the WHERE clause and parameters for the given filters."""
+        clauses = []
+        params = []
+        if topic:
+            clauses.append("topic LIKE ? ESCAPE '\\'")
+            escaped = topic.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f"%{escaped}%")
+        if video_lengths is not None:
+            clauses.append(f"video_length IN ({', '.join('?' * len(video_lengths)) or 'NULL'})")
+            params.extend(int(length) for length in video_lengths)
+        if provider:
+            clauses.append("provider = ?")
+            params.append(provider)
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _to_item(row):
+        item = dict(zip(HISTORY_COLUMNS, row))
+        item['timestamp'] = datetime.fromisoformat(item['timestamp'])
+        return item
+
+    def count(self, **filters):
+        """Returns the number of stored scripts matching the filters."""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def query(self, limit=None, offset=0, **filters):
+        """Returns one page of matching scripts, newest first."""
+        where, params = self._where(**filters)
+        sql = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history{where} ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def iter_items(self, batch_size=200, **filters):
+        """Yields every matching script, oldest first, fetching batch_size rows at a time.
+
+        The lock is only held while a batch is fetched, so long exports don't block other sessions.
+        """
+        where, params = self._where(**filters)
+        last_id = 0
+        while True:
+            sql_where = f"{where} AND id > ?" if where else " WHERE id > ?"
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history{sql_where} ORDER BY id LIMIT ?",
+                    params + [last_id, batch_size]
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_item(row)
+            last_id = rows[-1][0]
+
+    def provider_models(self):
+        """Returns the distinct (provider, model) pairs in history."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT DISTINCT provider, model FROM history WHERE provider IS NOT NULL ORDER BY provider, model"
+            ).fetchall()
+
+    def _items_by_id(self, item_ids):
+        """Returns {id: item} for the given ids; the caller holds the lock."""
+        rows = self._conn.execute(
+            f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history WHERE id IN ({', '.join('?' * len(item_ids))})",
+            list(item_ids)
+        ).fetchall()
+        return {row[0]: self._to_item(row) for row in rows}
+
+    def similar_topics(self, topic, limit=5, min_similarity=0.3, max_candidates=500):
+        """Returns stored topics that share terms with topic, most similar first.
+
+        Each match is a dict with the stored topic, its term similarity (Jaccard) to topic, how many
+        scripts were stored for it and the newest of them as item. Candidates come from the topic
+        term index, at most max_candidates scripts sharing the most terms.
+        """
+        terms = topic_terms(topic)
+        if not terms:
+            return []
+        self._backfill_index()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.item_id, h.topic FROM (SELECT item_id, COUNT(*) AS shared FROM topic_terms "
+                f"WHERE term IN ({', '.join('?' * len(terms))}) GROUP BY item_id "
+                "ORDER BY shared DESC, item_id DESC LIMIT ?) t JOIN history h ON h.id = t.item_id",
+                terms + [int(max_candidates)]
+            ).fetchall()
+        newest = {}
+        for item_id, stored_topic in rows:
+            key = stored_topic.strip().lower()
+            if item_id > newest.get(key, (0, None))[0]:
+                newest[key] = (item_id, stored_topic)
+        scored = sorted(
+            ((term_similarity(terms, topic_terms(stored_topic)), item_id) for item_id, stored_topic in newest.values()),
+            reverse=True
+        )
+        scored = [(similarity, item_id) for similarity, item_id in scored if similarity >= min_similarity][:limit]
+        if not scored:
+            return []
+        with self._lock:
+            items = self._items_by_id([item_id for _, item_id in scored])
+            return [
+                {
+                    "topic": items[item_id]["topic"],
+                    "similarity": similarity,
+                    "count": self._conn.execute(
+                        "SELECT COUNT(*) FROM history WHERE topic = ? COLLATE NOCASE", (items[item_id]["topic"],)
+                    ).fetchone()[0],
+                    "item": items[item_id],
+                }
+                for similarity, item_id in scored if item_id in items
+            ]
+
+    def similar_scripts(self, script, limit=5, min_similarity=DUPLICATE_SIMILARITY, exclude_id=None):
+        """Returns (similarity, item) for stored scripts that are near-duplicates of script, most
+        similar first. Candidates share an LSH band with script, so only they are compared."""
+        signature = script_signature(script)
+        if signature is None:
+            return []
+        self._backfill_index()
+        keys = band_keys(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.item_id, s.signature FROM script_signatures s WHERE s.item_id IN "
+                f"(SELECT item_id FROM script_bands WHERE band_key IN ({', '.join('?' * len(keys))}))",
+                keys
+            ).fetchall()
+        scored = sorted(
+            (
+                (signature_similarity(signature, decode_signature(data)), item_id)
+                for item_id, data in rows if item_id != exclude_id
+            ),
+            reverse=True
+        )
+        scored = [(similarity, item_id) for similarity, item_id in scored if similarity >= min_similarity][:limit]
+        if not scored:
+            return []
+        with self._lock:
+            items = self._items_by_id([item_id for _, item_id in scored])
+        return [(similarity, items[item_id]) for similarity, item_id in scored if item_id in items]
+
+    def delete(self, item_id):
+        """Deletes one script by id."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM history WHERE id = ?", (item_id,))
+            for table in ("script_signatures", "script_bands", "topic_terms"):
+                self._conn.execute(f"DELETE FROM {table} WHERE item_id = ?", (item_id,))
+
+    def clear(self):
+        """Deletes every stored script."""
+        with self._lock, self._conn:
+            for table in ("history", "script_signatures", "script_bands", "topic_terms"):
+                self._conn.execute(f"DELETE FROM {table}")
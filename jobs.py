@@ -0,0 +1,157 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from generation import CANCELLED_ERROR, run_batch, variation_avatars
+from settings import DEFAULT_MAX_CONCURRENCY
+
+# How many batch jobs run at once; later jobs wait their turn. Requests from all running jobs
+# still share the provider's rate limits and concurrency cap.
+MAX_RUNNING_JOBS = 2
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+VARIATION_PENDING = "pending"
+VARIATION_STREAMING = "streaming"
+VARIATION_DONE = "done"
+VARIATION_FAILED = "failed"
+VARIATION_CANCELLED = "cancelled"
+
+
+class BatchJob:
+    """One batch of variations generated in the background.
+
+    The worker thread updates status, partial_scripts, variation_status and results while the
+    script thread reads them on every rerun. Each update replaces a single attribute or list item,
+    so readers see a consistent value without locking.
+    """
+
+    def __init__(self, job_id, config, topic, video_length, avatar=None, n_variations=7, cache=None,
+                 batch_mode="Per variation", stream=True, history=None):
+        self.id = job_id
+        self.config = config
+        self.topic = topic
+        self.video_length = video_length
+        self.avatar = avatar
+        self.n_variations = n_variations
+        self.cache = cache
+        self.batch_mode = batch_mode
+        self.stream = stream
+        self.history = history
+        self.status = QUEUED
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.partial_scripts = [None] * n_variations
+        self.variation_status = [VARIATION_PENDING] * n_variations
+        # One (script, desc_tag, error) tuple per variation once the job has finished
+        self.results = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def finished_variations(self):
+        return sum(1 for status in self.variation_status if status not in (VARIATION_PENDING, VARIATION_STREAMING))
+
+    @property
+    def elapsed(self):
+        """Seconds the job has been running, or ran for; None while queued."""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def on_update(self, idx, partial_script):
+        self.partial_scripts[idx] = partial_script
+        if self.variation_status[idx] == VARIATION_PENDING:
+            self.variation_status[idx] = VARIATION_STREAMING
+
+    def on_done(self, idx, result):
+        script, _, error = result
+        if error == CANCELLED_ERROR:
+            self.variation_status[idx] = VARIATION_CANCELLED
+        elif script:
+            self.partial_scripts[idx] = script
+            self.variation_status[idx] = VARIATION_DONE
+        else:
+            self.variation_status[idx] = VARIATION_FAILED
+
+    def run(self):
+        """Generates the batch on the calling thread and stores the results; never raises."""
+        if self.cancel_event.is_set():
+            self.status = CANCELLED
+            return
+        # started_at first: the page reads elapsed as soon as it sees RUNNING
+        self.started_at = time.time()
+        self.status = RUNNING
+        try:
+            results = run_batch(
+                self.config, self.topic, self.video_length, self.avatar, self.n_variations,
+                self.config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY), self.cache, self.batch_mode,
+                on_update=self.on_update if self.stream else None, on_done=self.on_done,
+                cancel_event=self.cancel_event
+            )
+            self.save_to_history(results)
+            self.results = results
+            self.status = CANCELLED if self.cancel_event.is_set() else DONE
+        except Exception as e:
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.finished_at = time.time()
+
+    def save_to_history(self, results):
+        if self.history is None:
+            return
+        completed_at = datetime.now()
+        avatars = variation_avatars(self.avatar, self.n_variations)
+        for idx, (script, desc_tag, _) in enumerate(results):
+            if script:
+                self.history.add(
+                    self.topic, self.video_length, script, avatar=avatars[idx], timestamp=completed_at,
+                    description=desc_tag, provider=self.config["api_provider"], model=self.config["model"]
+                )
+
+
+class JobManager:
+    """Runs BatchJobs on background threads, outside Streamlit's rerun cycle.
+
+    Up to max_running jobs run at once and the rest wait in submission order. Jobs keep running
+    when the page reruns or the browser disconnects; whoever holds the BatchJob can read its
+    progress and results at any time.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="batch-job")
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, config, topic, video_length, avatar=None, n_variations=7, cache=None,
+               batch_mode="Per variation", stream=True, history=None):
+        """Queues a batch and returns its BatchJob straight away. Scripts that are generated are added
+        to history (a HistoryStore), if given, when the job finishes."""
+        with self._lock:
+            job_id = next(self._ids)
+        job = BatchJob(job_id, config, topic, video_length, avatar, n_variations, cache, batch_mode, stream, history)
+        job.future = self._executor.submit(job.run)
+        return job
+
+    @staticmethod
+    def cancel(job):
+        """Cancels a job: a queued job never starts, and a running one stops before its next request
+        or streamed row. Variations that already finished keep their results."""
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = CANCELLED
+            job.variation_status = [VARIATION_CANCELLED] * job.n_variations
+            job.finished_at = time.time()
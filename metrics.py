@@ -0,0 +1,309 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+
+# Samples kept per series for the percentiles; older samples still count towards the totals
+MAX_SAMPLES = 2000
+QUANTILES = (0.5, 0.95, 0.99)
+TIMING_METRICS = ("queue_wait", "ttft", "latency")
+PROMETHEUS_PREFIX = "tiktok_provider"
+
+
+def percentile(sorted_values, quantile):
+    """Nearest-rank percentile of an already sorted list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(quantile * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Series:
+    """Counters and recent timing samples for one (provider, model, kind) combination."""
+
+    __slots__ = ("calls", "errors", "retries", "cache_hits", "cache_misses", "prompt_tokens",
+                 "cached_prompt_tokens", "completion_tokens", "hedged_requests", "hedges", "failovers",
+                 "hedge_wins", "counts", "sums", "samples")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.hedged_requests = 0
+        self.hedges = 0
+        self.failovers = 0
+        self.hedge_wins = 0
+        self.counts = dict.fromkeys(TIMING_METRICS, 0)
+        self.sums = dict.fromkeys(TIMING_METRICS, 0.0)
+        self.samples = {name: deque(maxlen=MAX_SAMPLES) for name in TIMING_METRICS}
+
+
+class MetricsRegistry:
+    """Thread-safe, in-process store of provider call metrics.
+
+    Every provider call records its queue wait (time spent waiting for a worker or rate-limit slot),
+    time to first token, total latency, token usage (including prompt tokens the provider served from
+    its prompt cache) and retry count, and every response cache
+    lookup records a hit or miss. Requests that can fall back on other providers record hedges,
+    failovers and which provider won. Series are keyed by provider, model and kind of request
+    ("script", "description" or "structured").
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self.started_at = time.time()
+
+    def _get(self, provider, model, kind):
+        key = (provider, model, kind)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = Series()
+        return series
+
+    def record_call(self, provider, model, kind, queue_wait, ttft, latency, prompt_tokens=0,
+                    completion_tokens=0, retries=0, error=False, cached_prompt_tokens=0):
+        """Records one provider call; timings are in seconds."""
+        with self._lock:
+            series = self._get(provider, model, kind)
+            series.calls += 1
+            series.errors += bool(error)
+            series.retries += retries
+            series.prompt_tokens += prompt_tokens or 0
+            series.cached_prompt_tokens += cached_prompt_tokens or 0
+            series.completion_tokens += completion_tokens or 0
+            for name, value in (("queue_wait", queue_wait), ("ttft", ttft), ("latency", latency)):
+                if value is not None:
+                    series.counts[name] += 1
+                    series.sums[name] += value
+                    series.samples[name].append(value)
+
+    def record_cache(self, provider, model, kind, hit):
+        """Records one response cache lookup."""
+        with self._lock:
+            series = self._get(provider, model, kind)
+            if hit:
+                series.cache_hits += 1
+            else:
+                series.cache_misses += 1
+
+    def record_hedge(self, provider, model, kind, event):
+        """Records one hedging event (see hedging.race): "request" under the primary provider,
+        "hedge" or "failover" under the provider that was backed up, "win" under the provider
+        whose result was used."""
+        with self._lock:
+            series = self._get(provider, model, kind)
+            if event == "request":
+                series.hedged_requests += 1
+            elif event == "hedge":
+                series.hedges += 1
+            elif event == "failover":
+                series.failovers += 1
+            elif event == "win":
+                series.hedge_wins += 1
+
+    def latency_quantile(self, provider, model, kind, quantile, min_samples=1):
+        """The quantile of recent call latencies in one series, or None with fewer than min_samples."""
+        with self._lock:
+            series = self._series.get((provider, model, kind))
+            samples = sorted(series.samples["latency"]) if series else []
+        if len(samples) < max(1, min_samples):
+            return None
+        return percentile(samples, quantile)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self.started_at = time.time()
+
+    def summary(self, prices=None):
+        """Returns one dict per series with its counters and p50/p95/p99 of every timing, in seconds.
+
+        prices maps a model name to {"input": ..., "output": ...} in US dollars per million tokens,
+        optionally with a discounted "cached_input" price; series for priced models get an estimated_cost.
+        """
+        with self._lock:
+            snapshot = [
+                (key, series.calls, series.errors, series.retries, series.cache_hits, series.cache_misses,
+                 series.prompt_tokens, series.cached_prompt_tokens, series.completion_tokens,
+                 series.hedged_requests, series.hedges, series.failovers, series.hedge_wins,
+                 dict(series.counts), dict(series.sums),
+                 {name: sorted(samples) for name, samples in series.samples.items()})
+                for key, series in sorted(self._series.items(), key=lambda entry: tuple(map(str, entry[0])))
+            ]
+        rows = []
+        for ((provider, model, kind), calls, errors, retries, cache_hits, cache_misses,
+             prompt_tokens, cached_prompt_tokens, completion_tokens, hedged_requests, hedges, failovers, hedge_wins,
+             counts, sums, samples) in snapshot:
+            lookups = cache_hits + cache_misses
+            row = {
+                "provider": provider,
+                "model": model,
+                "kind": kind,
+                "calls": calls,
+                "errors": errors,
+                "retries": retries,
+                "cache_hits": cache_hits,
+                "cache_misses": cache_misses,
+                "cache_hit_rate": cache_hits / lookups if lookups else None,
+                "prompt_tokens": prompt_tokens,
+                "cached_prompt_tokens": cached_prompt_tokens,
+                "cached_prompt_share": cached_prompt_tokens / prompt_tokens if prompt_tokens else None,
+                "completion_tokens": completion_tokens,
+                "hedged_requests": hedged_requests,
+                "hedges": hedges,
+                "failovers": failovers,
+                "hedge_wins": hedge_wins,
+                "hedge_rate": hedges / hedged_requests if hedged_requests else None
+            }
+            for name in TIMING_METRICS:
+                row[f"{name}_sum"] = sums[name]
+                row[f"{name}_count"] = counts[name]
+                for quantile in QUANTILES:
+                    row[f"{name}_p{int(quantile * 100)}"] = percentile(samples[name], quantile)
+            price = (prices or {}).get(model)
+            if price:
+                input_price = price.get("input", 0)
+                row["estimated_cost"] = (
+                    (prompt_tokens - cached_prompt_tokens) * input_price
+                    + cached_prompt_tokens * price.get("cached_input", input_price)
+                    + completion_tokens * price.get("output", 0)
+                ) / 1_000_000
+            rows.append(row)
+        return rows
+
+    def to_json(self, prices=None):
+        """Serializes the summary as a JSON document."""
+        return json.dumps({"since": self.started_at, "series": self.summary(prices)}, indent=2)
+
+    def to_prometheus(self):
+        """Serializes the metrics in the Prometheus text exposition format.
+
+        Timings are exported as summaries with 0.5/0.95/0.99 quantiles; counters as counters.
+        """
+        rows = self.summary()
+        lines = []
+        for name, help_text in (
+            ("queue_wait", "Time spent waiting for a worker or rate-limit slot before the call."),
+            ("ttft", "Time from sending the request to the first token of the response."),
+            ("latency", "Time from sending the request to the end of the response.")
+        ):
+            metric = f"{PROMETHEUS_PREFIX}_{name}_seconds"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for row in rows:
+                labels = prometheus_labels(row)
+                for quantile in QUANTILES:
+                    value = row[f"{name}_p{int(quantile * 100)}"]
+                    if value is not None:
+                        lines.append(f'{metric}{{{labels},quantile="{quantile}"}} {value:.6f}')
+                lines.append(f"{metric}_sum{{{labels}}} {row[f'{name}_sum']:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {row[f'{name}_count']}")
+        for name, help_text in (
+            ("calls", "Provider calls made."),
+            ("errors", "Provider calls that failed after all retries."),
+            ("retries", "Retries after throttled or failed attempts."),
+            ("cache_hits", "Response cache hits."),
+            ("cache_misses", "Response cache misses."),
+            ("prompt_tokens", "Prompt tokens used."),
+            ("cached_prompt_tokens", "Prompt tokens served from the provider's prompt cache."),
+            ("completion_tokens", "Completion tokens used."),
+            ("hedged_requests", "Requests sent with fallback providers configured."),
+            ("hedges", "Backup requests sent because this series was slower than the hedge threshold."),
+            ("failovers", "Backup requests sent because this series failed."),
+            ("hedge_wins", "Requests with more than one attempt whose result came from this series.")
+        ):
+            metric = f"{PROMETHEUS_PREFIX}_{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for row in rows:
+                lines.append(f"{metric}{{{prometheus_labels(row)}}} {row[name]}")
+        return '\n'.join(lines) + '\n'
+
+
+class CallRecorder:
+    """Times one provider call and records it in a MetricsRegistry when finished.
+
+    Pass on_start and on_retry to ProviderLimiter.acquire; call first_token() when the first streamed
+    chunk arrives and finish() once the response has been read. For non-streamed calls the time to
+    first token equals the latency.
+    """
+
+    def __init__(self, provider, model, kind, queued_since=None, registry=None):
+        self.registry = registry or _registry
+        self.provider = provider
+        self.model = model
+        self.kind = kind
+        self.created = time.monotonic()
+        self.queued_since = self.created if queued_since is None else queued_since
+        self.queue_wait = 0.0
+        self.sent_at = None
+        self.first_token_at = None
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.finished = False
+
+    def on_start(self, waited):
+        """Called right before each attempt with the seconds spent waiting for rate-limit slots."""
+        if self.sent_at is None:
+            self.queue_wait = self.created - self.queued_since
+        self.queue_wait += waited
+        self.sent_at = time.monotonic()
+        self.first_token_at = None
+
+    def on_retry(self, attempt, error, delay):
+        self.retries += 1
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def set_usage(self, prompt_tokens, completion_tokens, cached_prompt_tokens=0):
+        self.prompt_tokens = prompt_tokens or 0
+        self.completion_tokens = completion_tokens or 0
+        self.cached_prompt_tokens = cached_prompt_tokens or 0
+
+    def finish(self, error=False, stopped=False):
+        """Records the call; later calls are ignored.
+
+        A stopped call (a hedge that lost, or a cancelled request) is counted without its latency,
+        which was cut short and would skew the quantiles hedging delays are based on, and with a
+        time to first token only if one arrived.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        ttft = latency = None
+        if self.sent_at is not None:
+            end = time.monotonic()
+            if not stopped:
+                latency = end - self.sent_at
+            if not stopped or self.first_token_at is not None:
+                ttft = (self.first_token_at or end) - self.sent_at
+        self.registry.record_call(
+            self.provider, self.model, self.kind, self.queue_wait, ttft, latency,
+            self.prompt_tokens, self.completion_tokens, self.retries, error, self.cached_prompt_tokens
+        )
+
+
+def prometheus_labels(row):
+    """Formats the provider/model/kind labels of a summary row, escaping backslashes and quotes."""
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(row[name])}"' for name in ("provider", "model", "kind"))
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    """Returns the process-wide metrics registry."""
+    return _registry
@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+
+# Status codes worth retrying: throttling, timeouts and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# Exception class names for transport failures in the OpenAI and Google SDKs
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "DeadlineExceeded", "ServiceUnavailable",
+    "InternalServerError", "TooManyRequests", "ResourceExhausted"
+}
+THROTTLE_ERROR_NAMES = {"RateLimitError", "TooManyRequests", "ResourceExhausted"}
+
+
+class TokenBucket:
+    """Allows up to rate_per_minute units per minute, refilled continuously. A rate of 0 means unlimited."""
+
+    def __init__(self, rate_per_minute=0):
+        self._lock = threading.Lock()
+        self.configure(rate_per_minute)
+
+    def configure(self, rate_per_minute):
+        with self._lock:
+            self.rate_per_minute = rate_per_minute or 0
+            self.capacity = float(self.rate_per_minute)
+            self.available = self.capacity
+            self.updated = time.monotonic()
+
+    def acquire(self, amount=1):
+        """Blocks until amount units are available and takes them."""
+        while True:
+            with self._lock:
+                if not self.rate_per_minute:
+                    return
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+                self.updated = now
+                # A single request bigger than the whole bucket waits for a full bucket instead of forever
+                amount = min(amount, self.capacity)
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) * 60 / self.capacity
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """Concurrency gate that halves its limit when the provider throttles and grows back by one
+    after every limit-many successful calls in a row (AIMD)."""
+
+    def __init__(self, max_limit):
+        self._cond = threading.Condition()
+        self.max_limit = max(1, int(max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+
+    def configure(self, max_limit):
+        with self._cond:
+            self.max_limit = max(1, int(max_limit))
+            self.limit = min(self.limit, self.max_limit)
+            self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class ProviderLimiter:
+    """Request and token budgets, adaptive concurrency and retry policy for one provider account."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=4, max_retries=5,
+                 base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.settings = None
+
+    def configure(self, requests_per_minute, tokens_per_minute, max_concurrency, max_retries):
+        """Applies new limits; a no-op if they haven't changed."""
+        settings = (requests_per_minute, tokens_per_minute, max_concurrency, max_retries)
+        if settings == self.settings:
+            return
+        self.settings = settings
+        self.requests.configure(requests_per_minute)
+        self.tokens.configure(tokens_per_minute)
+        self.concurrency.configure(max_concurrency)
+        self.max_retries = max_retries
+
+    def backoff(self, attempt, error=None):
+        """Seconds to wait before retry number attempt: the server's Retry-After if it sent one,
+        otherwise full-jitter exponential backoff."""
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def acquire(self, fn, estimated_tokens=0, on_retry=None, on_start=None):
+        """Runs fn() within the rate limits, retrying retryable errors with backoff, and returns its
+        result while still holding its concurrency slot. The caller must call release() once it is
+        done with the result, e.g. after reading a streamed response to the end.
+
+        on_retry(attempt, error, delay), if given, is called before each retry sleep, and
+        on_start(waited) right before each attempt with the seconds spent waiting for slots.
+        """
+        attempt = 0
+        while True:
+            waiting_since = time.monotonic()
+            self.requests.acquire()
+            self.tokens.acquire(estimated_tokens)
+            self.concurrency.acquire()
+            if on_start:
+                on_start(time.monotonic() - waiting_since)
+            try:
+                return fn()
+            except Exception as e:
+                self.concurrency.release(is_throttle_error(e))
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                error = e
+            delay = self.backoff(attempt, error)
+            if on_retry:
+                on_retry(attempt + 1, error, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def release(self, throttled=False):
+        """Gives back the concurrency slot held since acquire() returned."""
+        self.concurrency.release(throttled)
+
+
+def error_status_code(error):
+    """HTTP status of an SDK error: status_code on OpenAI errors, code on Google API errors."""
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_throttle_error(error):
+    return error_status_code(error) == 429 or type(error).__name__ in THROTTLE_ERROR_NAMES
+
+
+def is_retryable_error(error):
+    return error_status_code(error) in RETRYABLE_STATUS_CODES or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def retry_after_seconds(error):
+    """Reads the Retry-After (or retry-after-ms) header from an error's HTTP response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form; fall back to exponential backoff
+        return None
+    return None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider, api_key, requests_per_minute=0, tokens_per_minute=0, max_concurrency=4, max_retries=5):
+    """Returns the process-wide limiter for a provider account, updated to the given limits."""
+    with _limiters_lock:
+        limiter = _limiters.get((provider, api_key))
+        if limiter is None:
+            limiter = _limiters[(provider, api_key)] = ProviderLimiter()
+    limiter.configure(requests_per_minute, tokens_per_minute, max_concurrency, max_retries)
+    return limiter
@@ -0,0 +1,245 @@
+import re
+from functools import lru_cache
+
+TIMESTAMP_RANGE_RE = re.compile(r"(\d+):(\d{2})\s*[-–]\s*(\d+):(\d{2})")
+# Splits on pipes that are not escaped with a backslash
+CELL_SPLIT_RE = re.compile(r"(?<!\\)\|")
+SEPARATOR_CELL_RE = re.compile(r"^:?-{3,}:?$")
+# Comfortable speaking pace for a voiceover; faster segments get flagged by validate_script_timing
+DEFAULT_MAX_WORDS_PER_SECOND = 3.0
+
+
+class ScriptTable:
+    """The markdown table of a generated script, parsed once.
+
+    rows are tuples with exactly one cell per header: short rows are padded with empty cells and
+    surplus cells are folded into the last column.
+    """
+
+    __slots__ = ("headers", "rows")
+
+    def __init__(self, headers, rows):
+        self.headers = headers
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        """Returns the values of the named column, or None if the table has no such column."""
+        if name not in self.headers:
+            return None
+        idx = self.headers.index(name)
+        return [row[idx] for row in self.rows]
+
+
+def split_table_row(line):
+    """Returns the cells of a markdown table row, or None for separator rows and non-table lines."""
+    line = line.strip()
+    if not line.startswith('|'):
+        return None
+    body = line[1:-1] if line.endswith('|') and len(line) > 1 else line[1:]
+    cells = [cell.strip().replace('\\|', '|') for cell in CELL_SPLIT_RE.split(body)]
+    if all(SEPARATOR_CELL_RE.match(cell) for cell in cells):
+        return None
+    return cells
+
+
+@lru_cache(maxsize=1024)
+def parse_script_table(script):
+    """Parses the first markdown table in a script, ignoring any text around it.
+
+    Memoized on the script text, so exports and the UI can call it freely on every rerun.
+    Returns an empty ScriptTable if the script has no table.
+    """
+    headers = None
+    rows = []
+    in_table = False
+    for line in script.split('\n'):
+        stripped = line.strip()
+        if not stripped.startswith('|'):
+            if in_table:
+                break
+            continue
+        in_table = True
+        cells = split_table_row(stripped)
+        if cells is None:
+            continue
+        if headers is None:
+            headers = tuple(cells)
+            continue
+        if len(cells) < len(headers):
+            cells += [''] * (len(headers) - len(cells))
+        elif len(cells) > len(headers):
+            cells[len(headers) - 1:] = [' | '.join(cells[len(headers) - 1:])]
+        rows.append(tuple(cells))
+    return ScriptTable(headers or (), tuple(rows))
+
+
+def parse_timestamp_range(value):
+    """Parses a 'm:ss-m:ss' Timestamp cell into (start, end) seconds, or None if it isn't one."""
+    match = TIMESTAMP_RANGE_RE.search(value)
+    if not match:
+        return None
+    start_min, start_sec, end_min, end_sec = (int(g) for g in match.groups())
+    return start_min * 60 + start_sec, end_min * 60 + end_sec
+
+
+def format_timestamp_range(start, end):
+    """Formats (start, end) seconds as a 'm:ss-m:ss' Timestamp cell."""
+    return f"{start // 60}:{start % 60:02d}-{end // 60}:{end % 60:02d}"
+
+
+def count_words(text):
+    """Spoken words in a Voiceover cell, ignoring quote marks."""
+    return len(text.replace('"', ' ').split())
+
+
+def segment_durations(segments):
+    """Seconds each parsed segment covers, or None for unparsed ones. A segment that starts one
+    second after the previous one ends (0:00-0:03, 0:04-0:08) also covers that second."""
+    durations = []
+    previous_end = None
+    for segment in segments:
+        if segment is None:
+            durations.append(None)
+            previous_end = None
+            continue
+        start, end = segment
+        if previous_end is not None and start == previous_end + 1:
+            start = previous_end
+        durations.append(end - start)
+        previous_end = end
+    return durations
+
+
+def validate_script_timing(script, video_length, max_words_per_second=DEFAULT_MAX_WORDS_PER_SECOND):
+    """Checks a script's table for timing problems.
+
+    Checks that every Timestamp parses and moves forward, that each segment starts where the
+    previous one ended (a one-second step, as in 0:03 then 0:04, is fine), that the last segment
+    ends at video_length, and that no Voiceover needs more than max_words_per_second words per
+    second of its segment. Returns [(row_index, problem)], with a row_index of None for problems
+    with the table as a whole; an empty list means the script is fine.
+    """
+    table = parse_script_table(script)
+    timestamps = table.column('Timestamp')
+    if not table or timestamps is None:
+        return [(None, "The script has no table with a Timestamp column.")]
+    video_length = int(video_length)
+    segments = [parse_timestamp_range(value) for value in timestamps]
+    durations = segment_durations(segments)
+    voiceovers = table.column('Voiceover') or [''] * len(segments)
+
+    issues = []
+    previous_end = 0
+    for idx, segment in enumerate(segments):
+        if segment is None:
+            issues.append((idx, f"Timestamp '{timestamps[idx]}' is not a m:ss-m:ss range."))
+            previous_end = None
+            continue
+        start, end = segment
+        if end <= start:
+            issues.append((idx, f"Segment {timestamps[idx]} does not move forward."))
+        elif start >= video_length:
+            issues.append((idx, f"Segment {timestamps[idx]} starts after the {video_length}-second video ends."))
+        elif previous_end is not None and start > previous_end + 1:
+            issues.append((idx, f"Gap of {start - previous_end} seconds before segment {timestamps[idx]}."))
+        elif previous_end is not None and start < previous_end:
+            issues.append((idx, f"Segment {timestamps[idx]} overlaps the previous segment."))
+        elif durations[idx] and count_words(voiceovers[idx]) > durations[idx] * max_words_per_second:
+            issues.append((idx, (
+                f"Voiceover has {count_words(voiceovers[idx])} words for {durations[idx]} seconds "
+                f"(at most {int(durations[idx] * max_words_per_second)})."
+            )))
+        previous_end = end
+
+    # The total duration is checked on the last segment that starts before the video ends
+    last = max((idx for idx, segment in enumerate(segments) if segment and segment[0] < video_length), default=None)
+    if last is not None and segments[last][1] != video_length and not any(row == last for row, _ in issues):
+        issues.append((last, f"The script ends at {segments[last][1]} seconds instead of {video_length}."))
+    return issues
+
+
+def plan_segment_windows(script, video_length, rows):
+    """Picks a (start, end) Timestamp window in seconds for each row index in rows, so that once
+    rewritten to fit them the segments run back to back and end at video_length.
+
+    Rows that start after the video ends get None: they should be dropped rather than rewritten.
+    """
+    table = parse_script_table(script)
+    segments = [parse_timestamp_range(value) for value in table.column('Timestamp') or []]
+    video_length = int(video_length)
+    rows = set(rows)
+    # The last row that starts before the end of the video, which has to end exactly at video_length
+    last = max((idx for idx, segment in enumerate(segments) if segment is None or segment[0] < video_length),
+               default=len(segments) - 1)
+    windows = {}
+    previous_end = 0
+    for idx, segment in enumerate(segments):
+        if idx > last:
+            if idx in rows:
+                windows[idx] = None
+            continue
+        if idx not in rows:
+            if segment is not None:
+                previous_end = segment[1]
+            continue
+        start = min(previous_end, video_length - 1)
+        if idx == last:
+            end = video_length
+        else:
+            following = next((s for s in segments[idx + 1:last + 1] if s is not None), None)
+            next_start = following[0] if following else video_length
+            if segment is not None and start < segment[1] <= next_start:
+                end = segment[1]
+            elif next_start > start:
+                end = next_start
+            else:
+                # Share what is left of the video between the rows that are left
+                end = start + max(1, (video_length - start) // (last - idx + 1))
+            end = min(end, video_length)
+        windows[idx] = (start, max(end, start + 1))
+        previous_end = windows[idx][1]
+    return windows
+
+
+def format_table_row(cells):
+    """Formats cells as a markdown table row, escaping pipes inside cells."""
+    return "| " + " | ".join(cell.replace('|', '\\|') for cell in cells) + " |"
+
+
+def replace_table_rows(script, replacements):
+    """Returns script with data rows of its first table replaced.
+
+    replacements maps a row index (as in parse_script_table) to the new row's cells, or to None to
+    drop the row. Text around the table and every other row are kept as they are.
+    """
+    lines = script.split('\n')
+    row_index = -1
+    seen_header = False
+    in_table = False
+    kept = []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped.startswith('|'):
+            if in_table:
+                # Only the first table is touched
+                replacements = {}
+            kept.append(line)
+            continue
+        in_table = True
+        cells = split_table_row(stripped) if replacements else None
+        if cells is None:
+            kept.append(line)
+            continue
+        if not seen_header:
+            seen_header = True
+            kept.append(line)
+            continue
+        row_index += 1
+        if row_index not in replacements:
+            kept.append(line)
+        elif replacements[row_index] is not None:
+            kept.append(format_table_row(replacements[row_index]))
+    return '\n'.join(kept)
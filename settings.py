@@ -0,0 +1,148 @@
+import copy
+import json
+import os
+import threading
+
+from response_cache import ResponseCache
+from script_table import DEFAULT_MAX_WORDS_PER_SECOND
+from similarity import DUPLICATE_SIMILARITY
+
+SETTINGS_FILE = "settings.json"
+RESPONSE_CACHE_FILE = "response_cache.db"
+HISTORY_DB_FILE = "history.db"
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_CACHE_TTL_HOURS = 168
+DEFAULT_CACHE_MAX_ENTRIES = 5000
+DEFAULT_MAX_RETRIES = 5
+# Per-provider budgets; set these to your account's quota. 0 means unlimited.
+DEFAULT_RATE_LIMITS = {
+    "OpenAI": {"requests_per_minute": 500, "tokens_per_minute": 200000},
+    "OpenRouter": {"requests_per_minute": 0, "tokens_per_minute": 0},
+    "Gemini": {"requests_per_minute": 60, "tokens_per_minute": 1000000}
+}
+# US dollars per million prompt ("input") and completion ("output") tokens, by model name.
+# Only used to estimate costs on the Metrics tab; models without a price show no cost.
+DEFAULT_MODEL_PRICES = {}
+# Hedging sends a duplicate request to the next fallback provider once a request has run longer
+# than this latency quantile of the provider's recent calls; until it has DEFAULT_HEDGE_MIN_SAMPLES
+# calls, DEFAULT_HEDGE_DELAY_SECONDS is used instead.
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_DELAY_SECONDS = 30
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+DEFAULT_SETTINGS = {
+    "api_provider": "OpenAI",
+    "api_key": "",
+    "model": "gpt-4",
+    "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+    "stream_output": True,
+    "batch_mode": "Per variation",
+    "cache_enabled": True,
+    "cache_ttl_hours": DEFAULT_CACHE_TTL_HOURS,
+    "cache_max_entries": DEFAULT_CACHE_MAX_ENTRIES,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "rate_limits": DEFAULT_RATE_LIMITS,
+    "model_prices": DEFAULT_MODEL_PRICES,
+    # Ordered [{"api_provider": ..., "api_key": ..., "model": ...}] to fail over (and hedge) to
+    "fallback_providers": [],
+    "hedging_enabled": False,
+    "hedge_quantile": DEFAULT_HEDGE_QUANTILE,
+    "hedge_min_samples": DEFAULT_HEDGE_MIN_SAMPLES,
+    "hedge_delay_seconds": DEFAULT_HEDGE_DELAY_SECONDS,
+    "repair_segments": True,
+    "max_words_per_second": DEFAULT_MAX_WORDS_PER_SECOND,
+    "dedupe_variations": True,
+    "duplicate_similarity": DUPLICATE_SIMILARITY
+}
+
+
+# Parsed settings files, keyed by absolute path: (modification time, settings)
+_settings_cache = {}
+_settings_cache_lock = threading.Lock()
+
+
+def load_settings(path=SETTINGS_FILE):
+    """Loads settings from a JSON file.
+
+    The file is parsed once per process and only re-read if it changes on disk. Returns a copy, so
+    callers can modify it freely.
+    """
+    key = os.path.abspath(path)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except FileNotFoundError:
+        return copy.deepcopy(DEFAULT_SETTINGS)
+    with _settings_cache_lock:
+        cached = _settings_cache.get(key)
+        if cached is None or cached[0] != mtime:
+            with open(key, 'r') as f:
+                cached = _settings_cache[key] = (mtime, json.load(f))
+        return copy.deepcopy(cached[1])
+
+
+def save_settings(settings, path=SETTINGS_FILE):
+    """Saves settings to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=4)
+    with _settings_cache_lock:
+        _settings_cache.pop(os.path.abspath(path), None)
+
+
+def provider_rate_limits(settings, provider):
+    """Returns the requests/tokens per minute budget configured for provider."""
+    limits = dict(DEFAULT_RATE_LIMITS.get(provider, {"requests_per_minute": 0, "tokens_per_minute": 0}))
+    limits.update((settings.get("rate_limits") or {}).get(provider, {}))
+    return limits
+
+
+def single_provider_config(settings, provider, api_key, model):
+    """Provider config for one provider account, with its rate limits and the shared retry and
+    segment repair settings."""
+    limits = provider_rate_limits(settings, provider)
+    return {
+        "api_provider": provider,
+        "api_key": api_key,
+        "model": model,
+        "base_url": OPENROUTER_BASE_URL if provider == "OpenRouter" else None,
+        "requests_per_minute": int(limits["requests_per_minute"]),
+        "tokens_per_minute": int(limits["tokens_per_minute"]),
+        "max_concurrency": int(settings.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)),
+        "max_retries": int(settings.get("max_retries", DEFAULT_MAX_RETRIES)),
+        "repair_segments": bool(settings.get("repair_segments", True)),
+        "max_words_per_second": float(settings.get("max_words_per_second", DEFAULT_MAX_WORDS_PER_SECOND))
+    }
+
+
+def provider_config(settings):
+    """Builds the provider config snapshot used by the generation functions.
+
+    "fallbacks" lists a config per complete entry in fallback_providers, in order. "hedging" holds
+    the hedging policy when it is enabled and there is a fallback to hedge to, otherwise None.
+    "dedupe_variations" and "duplicate_similarity" control how batches regenerate near-duplicates.
+    """
+    config = single_provider_config(
+        settings, settings.get("api_provider", DEFAULT_SETTINGS["api_provider"]),
+        settings.get("api_key", ""), settings.get("model", DEFAULT_SETTINGS["model"])
+    )
+    config["fallbacks"] = [
+        single_provider_config(settings, fallback["api_provider"], fallback["api_key"], fallback["model"])
+        for fallback in settings.get("fallback_providers") or []
+        if fallback.get("api_provider") and fallback.get("api_key") and fallback.get("model")
+    ]
+    config["hedging"] = None
+    if settings.get("hedging_enabled") and config["fallbacks"]:
+        config["hedging"] = {
+            "quantile": float(settings.get("hedge_quantile", DEFAULT_HEDGE_QUANTILE)),
+            "min_samples": int(settings.get("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES)),
+            "delay_seconds": float(settings.get("hedge_delay_seconds", DEFAULT_HEDGE_DELAY_SECONDS))
+        }
+    config["dedupe_variations"] = bool(settings.get("dedupe_variations", True))
+    config["duplicate_similarity"] = float(settings.get("duplicate_similarity", DUPLICATE_SIMILARITY))
+    return config
+
+
+def open_response_cache(ttl_hours=DEFAULT_CACHE_TTL_HOURS, max_entries=DEFAULT_CACHE_MAX_ENTRIES, path=RESPONSE_CACHE_FILE):
+    """Opens the on-disk response cache with a TTL in hours; 0 disables expiry or the size bound."""
+    ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+    return ResponseCache(path, ttl_seconds=ttl_seconds, max_entries=max_entries or None)
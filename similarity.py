@@ -0,0 +1,138 @@
+import hashlib
+import re
+import struct
+
+from script_table import parse_script_table
+
+WORD_RE = re.compile(r"\w+")
+# Scripts are compared on overlapping runs of words; texts too short for one fall back to characters
+SHINGLE_WORDS = 3
+SHINGLE_CHARS = 5
+# 64 MinHash values in 16 LSH bands of 4: pairs above about 0.5 similarity share a band
+NUM_HASHES = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_HASHES // BANDS
+BIN_BITS = NUM_HASHES.bit_length() - 1
+SIGNATURE_FORMAT = f">{NUM_HASHES}Q"
+# Estimated share of shingles two scripts must have in common to count as near-duplicates
+DUPLICATE_SIMILARITY = 0.5
+TOPIC_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "about", "for", "how", "in", "is", "of", "on", "the", "to", "what", "why", "with",
+    "apa", "dan", "di", "dalam", "ini", "itu", "kat", "ke", "kenapa", "macam", "mana", "nak", "pasal", "pada",
+    "tentang", "untuk", "yang"
+})
+
+
+def script_text(script):
+    """The words a script says and shows: its Voiceover and Text Overlay columns, or the whole text
+    if it has no table."""
+    # Indexing parses every stored script once, so it bypasses the parse cache rather than evicting
+    # the scripts on screen
+    table = parse_script_table.__wrapped__(script)
+    parts = (table.column('Voiceover') or []) + (table.column('Text Overlay') or [])
+    return ' '.join(parts) if parts else script
+
+
+def shingles(text):
+    """The set of SHINGLE_WORDS-word runs in text, ignoring case and punctuation."""
+    words = WORD_RE.findall(text.lower())
+    if len(words) >= SHINGLE_WORDS:
+        return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    joined = ' '.join(words)
+    return {joined[i:i + SHINGLE_CHARS] for i in range(max(1, len(joined) - SHINGLE_CHARS + 1))} if joined else set()
+
+
+def minhash(shingle_set):
+    """MinHash signature of a set of shingles (a tuple of NUM_HASHES ints), or None for an empty set.
+
+    The share of positions where two signatures agree estimates the Jaccard similarity of their sets.
+    Each shingle is hashed once and its low bits pick one of NUM_HASHES bins that keeps its minimum
+    (one-permutation hashing), so signing costs one hash per shingle rather than NUM_HASHES. Empty
+    bins copy the next filled bin along, offset by the distance so copies stay distinct.
+    """
+    if not shingle_set:
+        return None
+    mask = NUM_HASHES - 1
+    bins = [None] * NUM_HASHES
+    for shingle in shingle_set:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        idx, value = h & mask, h >> BIN_BITS
+        if bins[idx] is None or value < bins[idx]:
+            bins[idx] = value
+    signature = list(bins)
+    for idx in range(NUM_HASHES):
+        if bins[idx] is None:
+            distance = 1
+            while bins[(idx + distance) & mask] is None:
+                distance += 1
+            signature[idx] = bins[(idx + distance) & mask] + (distance << (64 - BIN_BITS))
+    return tuple(signature)
+
+
+def script_signature(script):
+    """MinHash signature of a script's spoken and on-screen words, or None if it has none."""
+    return minhash(shingles(script_text(script)))
+
+
+def signature_similarity(a, b):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+
+def band_keys(signature):
+    """One LSH bucket key per band, as signed 64-bit ints for SQLite. Signatures that share any
+    key are candidate near-duplicates."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f">I{ROWS_PER_BAND}Q", band, *rows), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def encode_signature(signature):
+    return struct.pack(SIGNATURE_FORMAT, *signature)
+
+
+def decode_signature(data):
+    return struct.unpack(SIGNATURE_FORMAT, data)
+
+
+def topic_terms(topic):
+    """The distinct, lower-cased words of a topic, without stopwords and single letters."""
+    return sorted({
+        word for word in WORD_RE.findall(topic.lower())
+        if len(word) > 1 and word not in TOPIC_STOPWORDS
+    })
+
+
+def term_similarity(a, b):
+    """Jaccard similarity of two term lists."""
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def find_duplicates(scripts, threshold=DUPLICATE_SIMILARITY):
+    """Finds near-duplicates among scripts (None entries are skipped).
+
+    Returns {index: earlier_index} for every script at least threshold similar to an earlier
+    script that is not itself a duplicate. Candidate pairs come from shared LSH bands, so only
+    those are compared in full.
+    """
+    signatures = [script_signature(script) if script else None for script in scripts]
+    buckets = {}
+    duplicates = {}
+    for idx, signature in enumerate(signatures):
+        if signature is None:
+            continue
+        keys = band_keys(signature)
+        candidates = sorted({other for key in keys for other in buckets.get(key, ())})
+        for other in candidates:
+            if signature_similarity(signature, signatures[other]) >= threshold:
+                duplicates[idx] = other
+                break
+        else:
+            # Only originals are bucketed, so every duplicate points at a script that is kept
+            for key in keys:
+                buckets.setdefault(key, []).append(idx)
+    return duplicates
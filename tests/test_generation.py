@@ -0,0 +1,62 @@
+import json
+
+import generation
+from generation import has_valid_variation, parse_structured_variations, repair_script_timing
+
+TABLE = (
+    "| Timestamp | Visual | Text Overlay | Voiceover |\n"
+    "| --- | --- | --- | --- |\n"
+    "| 0:00-0:05 | [Speaker] | Hai | \"Hai korang\" |"
+)
+
+
+def test_parses_the_requested_variations_list():
+    text = json.dumps({"variations": [{"script": TABLE, "description": "d", "hashtags": "#a"}] * 2})
+    variations = parse_structured_variations(text)
+    assert [v['script'] for v in variations] == [TABLE, TABLE]
+    assert variations[0]['description'] == "Description: d\nHashtags: #a"
+
+
+def test_single_variation_object_counts_as_one_variation():
+    text = json.dumps({"script": TABLE, "description": "d", "hashtags": ["#a", "#b"]})
+    assert parse_structured_variations(text) == [{'script': TABLE, 'description': "Description: d\nHashtags: #a #b"}]
+    assert has_valid_variation(text)
+
+
+def test_object_without_variations_falls_back_to_markdown():
+    assert parse_structured_variations(json.dumps({"other": 1})) == []
+
+
+REPAIR_CONFIG = {"api_provider": "OpenRouter", "api_key": "test-repair", "model": "m", "repair_segments": True}
+HEADER = "| Timestamp | Visual | Text Overlay | Voiceover |\n| --- | --- | --- | --- |\n"
+# Rows 0 and 2 have too many words for their segments
+WORDY = HEADER + (
+    "| 0:00-0:03 | [a] | A | satu dua tiga empat lima enam tujuh lapan sembilan sepuluh |\n"
+    "| 0:03-0:10 | [b] | B | okay je |\n"
+    "| 0:10-0:15 | [c] | C | satu dua tiga empat lima enam tujuh lapan sembilan sepuluh "
+    "sebelas dua belas tiga belas empat belas lima belas enam belas |"
+)
+
+
+def reply_with(monkeypatch, text):
+    monkeypatch.setattr(generation, "request_segment_rows", lambda config, prompt, n_rows: text)
+
+
+def test_repaired_rows_are_matched_by_timestamp(monkeypatch):
+    # Rows come back in the wrong order, with a context row echoed in between
+    reply_with(monkeypatch, (
+        "| 0:10-0:15 | [c2] | C2 | last row fixed |\n"
+        "| 0:03-0:10 | [b] | B | okay je |\n"
+        "| 0:00-0:03 | [a2] | A2 | first row fixed |"
+    ))
+    script, issues = repair_script_timing(REPAIR_CONFIG, "kucing", 15, WORDY)
+    assert issues == []
+    rows = generation.parse_script_table(script).rows
+    assert [row[1] for row in rows] == ["[a2]", "[b]", "[c2]"]
+
+
+def test_a_reply_missing_a_row_is_discarded(monkeypatch):
+    reply_with(monkeypatch, "| 0:00-0:03 | [a2] | A2 | first row fixed |")
+    script, issues = repair_script_timing(REPAIR_CONFIG, "kucing", 15, WORDY)
+    assert script == WORDY
+    assert [row for row, _ in issues] == [0, 2]
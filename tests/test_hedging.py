@@ -0,0 +1,168 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import generation
+from hedging import FAILOVER, HEDGE, REQUEST, WIN, RaceCancelled, StopEvent, race
+
+
+def recorder():
+    events = []
+    return events, lambda event, config: events.append((event, config))
+
+
+def test_hedges_a_slow_attempt_after_the_delay():
+    stops = {}
+
+    def attempt(config, stop):
+        stops[config] = stop
+        if config == "slow":
+            stop.wait(5)
+            return "slow result"
+        return "fast result"
+
+    events, on_event = recorder()
+    start = time.monotonic()
+    assert race(["slow", "fast"], attempt, hedge_delay=lambda config: 0, on_event=on_event) == "fast result"
+    assert time.monotonic() - start >= 0.5
+    assert events == [(REQUEST, "slow"), (HEDGE, "slow"), (WIN, "fast")]
+    assert stops["slow"].is_set()
+
+
+def test_fails_over_when_an_attempt_raises():
+    def attempt(config, stop):
+        if config == "broken":
+            raise RuntimeError("boom")
+        return "backup result"
+
+    events, on_event = recorder()
+    assert race(["broken", "backup"], attempt, on_event=on_event) == "backup result"
+    assert events == [(REQUEST, "broken"), (FAILOVER, "broken"), (WIN, "backup")]
+
+
+def test_returns_the_first_invalid_result_when_none_is_valid():
+    results = {"a": "first invalid", "b": "second invalid"}
+    assert race(["a", "b"], lambda config, stop: results[config], is_valid=lambda result: False) == "first invalid"
+
+
+def test_raises_the_last_error_when_every_attempt_fails():
+    def attempt(config, stop):
+        raise RuntimeError(config)
+
+    with pytest.raises(RuntimeError, match="b"):
+        race(["a", "b"], attempt)
+
+
+def test_cancel_event_stops_every_attempt():
+    stops = []
+
+    def attempt(config, stop):
+        stops.append(stop)
+        stop.wait(5)
+
+    cancel_event = threading.Event()
+    threading.Timer(0.1, cancel_event.set).start()
+    with pytest.raises(RaceCancelled):
+        race(["a", "b"], attempt, hedge_delay=lambda config: None, cancel_event=cancel_event)
+    assert len(stops) == 1
+    assert stops[0].is_set()
+
+
+def test_stop_event_runs_callbacks_once_and_late_ones_straight_away():
+    stop = StopEvent()
+    calls = []
+    stop.on_set(lambda: calls.append("early"))
+    stop.set()
+    stop.set()
+    stop.on_set(lambda: calls.append("late"))
+    assert calls == ["early", "late"]
+
+
+class BlockingStream:
+    """A stream whose response never arrives until it is closed."""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        self.closed.wait(5)
+        return iter(())
+
+    def close(self):
+        self.closed.set()
+
+
+def test_stopping_an_attempt_closes_its_request_and_frees_its_slot():
+    stream = BlockingStream()
+    config = {"api_provider": "OpenRouter", "api_key": "test-stop-slot", "model": "m", "max_concurrency": 1}
+    limiter = generation.get_config_limiter(config)
+    stop = StopEvent()
+    outcome = []
+
+    def attempt(attempt_config, attempt_stop):
+        return generation.read_provider_stream(attempt_config, lambda: stream)
+
+    def run():
+        try:
+            generation.with_failover(config, "script", attempt, cancel_event=stop)
+        except generation.BatchCancelled:
+            outcome.append("cancelled")
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    while limiter.concurrency.in_flight == 0:
+        time.sleep(0.01)
+    stop.set()
+    assert stream.closed.is_set()
+    assert limiter.concurrency.in_flight == 0
+    worker.join(2)
+    assert outcome == ["cancelled"]
+
+
+class BrokenOnCloseStream:
+    """A stream that sends one chunk, then fails like a connection cut when it is closed."""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        delta = SimpleNamespace(content="| Timestamp |")
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        self.closed.wait(5)
+        raise ConnectionError("stream closed")
+
+    def close(self):
+        self.closed.set()
+
+
+def test_a_stopped_script_stream_is_cancelled_not_failed(monkeypatch):
+    stream = BrokenOnCloseStream()
+    completions = SimpleNamespace(create=lambda **kwargs: stream)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(generation, "get_config_client", lambda config, system_prompt=None: client)
+    config = {"api_provider": "OpenRouter", "api_key": "test-stop-script", "model": "m", "max_concurrency": 1}
+    limiter = generation.get_config_limiter(config)
+    stop = StopEvent()
+    outcome = []
+
+    def attempt(attempt_config, attempt_stop):
+        return "".join(generation.iter_script_chunks(attempt_config, "topic", 30))
+
+    def run():
+        try:
+            generation.with_failover(config, "script", attempt, cancel_event=stop)
+        except generation.BatchCancelled:
+            outcome.append("cancelled")
+        except ConnectionError:
+            outcome.append("failed")
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    while limiter.concurrency.in_flight == 0:
+        time.sleep(0.01)
+    stop.set()
+    worker.join(2)
+    assert outcome == ["cancelled"]
+    assert limiter.concurrency.in_flight == 0
@@ -0,0 +1,77 @@
+import sqlite3
+
+from history_store import HistoryStore
+
+INDEX_TABLES = ("script_signatures", "script_bands", "topic_terms")
+
+
+def words(start, stop):
+    return " ".join(f"w{i}" for i in range(start, stop))
+
+
+def index_rows(path):
+    with sqlite3.connect(path) as conn:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in INDEX_TABLES}
+
+
+def test_similar_scripts_finds_near_duplicates(tmp_path):
+    store = HistoryStore(tmp_path / "history.db")
+    original = store.add("Topic", 30, words(0, 100))
+    edited = store.add("Topic", 30, words(15, 115))
+    store.add("Other", 30, words(500, 600))
+
+    matches = store.similar_scripts(words(0, 100))
+    assert [item["id"] for _, item in matches] == [original, edited]
+    assert matches[0][0] == 1.0
+    assert [item["id"] for _, item in store.similar_scripts(words(0, 100), exclude_id=original)] == [edited]
+    assert store.similar_scripts(words(0, 100), min_similarity=1.0, exclude_id=original) == []
+    assert store.similar_scripts("") == []
+
+
+def test_similar_topics_ranks_topics_and_counts_their_scripts(tmp_path):
+    store = HistoryStore(tmp_path / "history.db")
+    store.add("How to grow tomatoes", 30, words(0, 10))
+    newest = store.add("how to grow tomatoes", 30, words(10, 20))
+    store.add("Tomatoes in winter", 30, words(20, 30))
+    store.add("Cooking pasta", 30, words(30, 40))
+
+    matches = store.similar_topics("grow tomatoes")
+    assert [(match["topic"], match["count"]) for match in matches] == [
+        ("how to grow tomatoes", 2), ("Tomatoes in winter", 1)
+    ]
+    assert matches[0]["similarity"] == 1.0 and matches[0]["item"]["id"] == newest
+    assert [match["topic"] for match in store.similar_topics("grow tomatoes", min_similarity=0.5)] == [
+        "how to grow tomatoes"
+    ]
+    assert store.similar_topics("how to") == []
+
+
+def test_scripts_stored_before_the_index_are_indexed_on_first_lookup(tmp_path):
+    path = tmp_path / "history.db"
+    item_id = HistoryStore(path).add("Grow tomatoes", 30, words(0, 100))
+    with sqlite3.connect(path) as conn:
+        for table in INDEX_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+
+    store = HistoryStore(path)
+    assert [item["id"] for _, item in store.similar_scripts(words(0, 100))] == [item_id]
+    assert [match["item"]["id"] for match in store.similar_topics("tomatoes")] == [item_id]
+    assert all(index_rows(path).values())
+
+
+def test_delete_and_clear_remove_index_rows(tmp_path):
+    path = tmp_path / "history.db"
+    store = HistoryStore(path)
+    kept = store.add("Grow tomatoes", 30, words(0, 100))
+    deleted = store.add("Cook pasta", 30, words(500, 600))
+    before = index_rows(path)
+
+    store.delete(deleted)
+    after = index_rows(path)
+    assert all(0 < after[table] < before[table] for table in INDEX_TABLES)
+    assert store.similar_scripts(words(500, 600)) == []
+    assert [item["id"] for _, item in store.similar_scripts(words(0, 100))] == [kept]
+
+    store.clear()
+    assert index_rows(path) == dict.fromkeys(INDEX_TABLES, 0)
+    assert store.count() == 0
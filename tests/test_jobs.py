@@ -0,0 +1,20 @@
+import jobs
+from jobs import DONE, RUNNING, BatchJob
+
+
+class RecordingJob(BatchJob):
+    """Records elapsed whenever the status changes, as the polling page would read it."""
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "status" and value == RUNNING:
+            self.elapsed_when_running = self.elapsed
+
+
+def test_running_job_always_has_an_elapsed_time(monkeypatch):
+    monkeypatch.setattr(jobs, "run_batch", lambda *args, **kwargs: [("| a |", "desc", None)])
+    job = RecordingJob(1, {"api_provider": "OpenAI", "model": "m"}, "kucing", 15, n_variations=1)
+    job.run()
+    assert job.status == DONE
+    assert job.elapsed_when_running is not None
+    assert f"{job.elapsed_when_running:.0f}"
@@ -0,0 +1,21 @@
+from metrics import CallRecorder, MetricsRegistry
+
+
+def finished_call(registry, stopped, first_token=False):
+    call = CallRecorder("OpenAI", "m", "script", registry=registry)
+    call.on_start(0.0)
+    if first_token:
+        call.first_token()
+    call.finish(stopped=stopped)
+
+
+def test_stopped_calls_leave_no_latency_sample():
+    registry = MetricsRegistry()
+    finished_call(registry, stopped=False)
+    finished_call(registry, stopped=True)
+    finished_call(registry, stopped=True, first_token=True)
+    row = registry.summary()[0]
+    assert row["calls"] == 3
+    assert row["errors"] == 0
+    assert registry.latency_quantile("OpenAI", "m", "script", 0.5, min_samples=2) is None
+    assert registry.latency_quantile("OpenAI", "m", "script", 0.5) is not None
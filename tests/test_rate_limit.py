@@ -0,0 +1,74 @@
+import threading
+from types import SimpleNamespace
+
+import generation
+from rate_limit import AdaptiveConcurrency, ProviderLimiter
+
+
+class ThrottleError(Exception):
+    status_code = 429
+
+
+def test_concurrency_halves_on_throttle_and_grows_back():
+    gate = AdaptiveConcurrency(4)
+    gate.acquire()
+    gate.release(throttled=True)
+    assert gate.limit == 2
+    for _ in range(2):
+        gate.acquire()
+        gate.release()
+    assert gate.limit == 3
+
+
+def test_acquire_holds_the_slot_until_release():
+    limiter = ProviderLimiter(max_concurrency=1)
+    assert limiter.acquire(lambda: "stream") == "stream"
+    assert limiter.concurrency.in_flight == 1
+
+    started = threading.Event()
+    second = threading.Thread(target=lambda: (limiter.acquire(lambda: None), started.set()))
+    second.start()
+    assert not started.wait(0.2)
+    limiter.release()
+    assert started.wait(2)
+    second.join()
+    limiter.release()
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_failed_attempt_releases_its_slot():
+    limiter = ProviderLimiter(max_concurrency=2, max_retries=0)
+    try:
+        limiter.acquire(lambda: (_ for _ in ()).throw(ThrottleError()))
+    except ThrottleError:
+        pass
+    assert limiter.concurrency.in_flight == 0
+    assert limiter.concurrency.limit == 1
+
+
+class FakeStream:
+    def __init__(self, texts):
+        self.texts = texts
+        self.closed = False
+
+    def __iter__(self):
+        for text in self.texts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+    def close(self):
+        self.closed = True
+
+
+def test_streamed_script_holds_its_slot_until_the_stream_closes(monkeypatch):
+    stream = FakeStream(["| a |", "| b |"])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: stream)))
+    monkeypatch.setattr(generation, "get_config_client", lambda config, system_instruction=None: client)
+    config = {"api_provider": "OpenRouter", "api_key": "test-stream-slot", "model": "m", "max_concurrency": 1}
+    limiter = generation.get_config_limiter(config)
+
+    chunks = generation.iter_script_chunks(config, "kucing", 15)
+    assert next(chunks) == "| a |"
+    assert limiter.concurrency.in_flight == 1
+    chunks.close()
+    assert stream.closed
+    assert limiter.concurrency.in_flight == 0
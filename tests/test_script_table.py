@@ -0,0 +1,80 @@
+from script_table import parse_script_table, plan_segment_windows, replace_table_rows, validate_script_timing
+
+HEADER = "| Timestamp | Visual | Text Overlay | Voiceover |\n| --- | --- | --- | --- |\n"
+
+
+def table(*rows):
+    """A script whose rows are (timestamp, voiceover) pairs."""
+    return HEADER + "\n".join(f"| {timestamp} | [v] | t | {voiceover} |" for timestamp, voiceover in rows)
+
+
+def words(n):
+    return " ".join(["kata"] * n)
+
+
+def problem_rows(script, video_length=15):
+    return [row for row, _ in validate_script_timing(script, video_length)]
+
+
+def test_a_well_timed_script_has_no_problems():
+    script = table(("0:00-0:03", words(9)), ("0:04-0:08", words(15)), ("0:09-0:15", words(10)))
+    assert validate_script_timing(script, 15) == []
+
+
+def test_flags_rows_that_need_more_than_the_word_limit():
+    script = table(("0:00-0:03", words(10)), ("0:03-0:15", words(5)))
+    assert problem_rows(script) == [0]
+    assert validate_script_timing(script, 15, max_words_per_second=4) == []
+
+
+def test_flags_unparsable_backwards_overlapping_and_gapped_segments():
+    script = table(
+        ("soon", "a"), ("0:03-0:02", "b"), ("0:02-0:06", "c"), ("0:05-0:08", "d"), ("0:12-0:15", "e")
+    )
+    issues = dict(validate_script_timing(script, 15))
+    assert "not a m:ss-m:ss range" in issues[0]
+    assert "does not move forward" in issues[1]
+    assert "overlaps" in issues[3]
+    assert "Gap of 4 seconds" in issues[4]
+
+
+def test_flags_a_wrong_total_length_and_rows_past_the_end():
+    assert dict(validate_script_timing(table(("0:00-0:10", "a")), 15)) == {
+        0: "The script ends at 10 seconds instead of 15."
+    }
+    issues = dict(validate_script_timing(table(("0:00-0:15", "a"), ("0:15-0:20", "b")), 15))
+    assert list(issues) == [1]
+    assert "starts after" in issues[1]
+
+
+def test_a_script_without_a_table_is_one_problem():
+    assert problem_rows("just text") == [None]
+
+
+def test_plans_windows_between_the_rows_that_are_kept():
+    script = table(("0:00-0:03", "a"), ("0:03-0:09", "b"), ("0:09-0:15", "c"))
+    assert plan_segment_windows(script, 15, {1}) == {1: (3, 9)}
+
+
+def test_plans_the_last_row_to_end_at_the_video_length():
+    script = table(("0:00-0:05", "a"), ("0:05-0:12", "b"))
+    assert plan_segment_windows(script, 15, {1}) == {1: (5, 15)}
+
+
+def test_plans_windows_for_unparsable_timestamps_and_drops_rows_past_the_end():
+    script = table(("0:00-0:05", "a"), ("later", "b"), ("0:10-0:15", "c"), ("0:16-0:20", "d"))
+    assert plan_segment_windows(script, 15, {1, 3}) == {1: (5, 10), 3: None}
+
+
+def test_replaces_and_drops_rows_and_keeps_the_rest():
+    script = "Intro\n" + table(("0:00-0:05", "a"), ("0:05-0:10", "b"), ("0:10-0:15", "c")) + "\nOutro"
+    replaced = replace_table_rows(script, {0: ["0:00-0:05", "[x]", "t", "a | b"], 2: None})
+    assert replaced.startswith("Intro\n") and replaced.endswith("\nOutro")
+    rows = parse_script_table(replaced).rows
+    assert rows == (("0:00-0:05", "[x]", "t", "a | b"), ("0:05-0:10", "[v]", "t", "b"))
+
+
+def test_only_the_first_table_is_replaced():
+    first = table(("0:00-0:15", "a"))
+    script = first + "\n\n" + first
+    assert replace_table_rows(script, {0: None}) == HEADER + "\n" + first
@@ -0,0 +1,59 @@
+from similarity import (NUM_HASHES, decode_signature, encode_signature, find_duplicates, minhash, script_signature,
+                        signature_similarity, topic_terms)
+
+HEADER = "| Timestamp | Visual | Text Overlay | Voiceover |\n| --- | --- | --- | --- |\n"
+
+
+def words(start, stop):
+    """A text of distinct words w<start>..w<stop - 1>, so overlapping ranges share shingles."""
+    return " ".join(f"w{i}" for i in range(start, stop))
+
+
+def similarity(a, b):
+    return signature_similarity(script_signature(a), script_signature(b))
+
+
+def test_identical_scripts_are_fully_similar_and_unrelated_ones_are_not():
+    assert similarity(words(0, 100), words(0, 100)) == 1.0
+    assert similarity(words(0, 100), words(200, 300)) == 0.0
+
+
+def test_scripts_are_compared_on_what_they_say_and_show():
+    first = HEADER + "| 0:00-0:05 | [a cat] | Hello | " + words(0, 30) + " |"
+    second = HEADER + "| 0:00-0:05 | [a dog] | Hello | " + words(0, 30) + " |"
+    assert similarity(first, second) == 1.0
+
+
+def test_empty_bins_get_distinct_values():
+    assert minhash(set()) is None
+    assert script_signature("") is None
+    # One shingle fills one bin; the other bins copy it, each offset by its own distance
+    signature = minhash({"only"})
+    assert len(set(signature)) == NUM_HASHES
+    assert signature_similarity(signature, minhash({"other"})) == 0.0
+
+
+def test_signatures_round_trip_through_bytes():
+    signature = script_signature(words(0, 50))
+    assert decode_signature(encode_signature(signature)) == signature
+
+
+def test_finds_duplicates_at_or_above_the_threshold():
+    original, edited, unrelated = words(0, 100), words(15, 115), words(500, 600)
+    assert find_duplicates([original, None, edited, unrelated, original]) == {2: 0, 4: 0}
+    estimate = similarity(original, edited)
+    assert find_duplicates([original, edited], threshold=estimate) == {1: 0}
+    assert find_duplicates([original, edited], threshold=estimate + 1 / NUM_HASHES) == {}
+
+
+def test_duplicates_only_point_at_scripts_that_are_kept():
+    first, second, third = words(0, 100), words(15, 115), words(45, 145)
+    # third is close to second but not to first, and second is a duplicate of first
+    assert similarity(first, second) >= 0.5 and similarity(second, third) >= 0.5
+    assert similarity(first, third) < 0.5
+    assert find_duplicates([first, second, third]) == {1: 0}
+
+
+def test_topic_terms_leave_out_stopwords_and_single_letters():
+    assert topic_terms("How to grow a Tomato in the garden") == ["garden", "grow", "tomato"]
+    assert topic_terms("Kenapa kucing suka tidur?") == ["kucing", "suka", "tidur"]